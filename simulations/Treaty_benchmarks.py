@@ -0,0 +1,193 @@
+### Benchmarks of the model, simulation and solver hot paths ###
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import scipy
+import Treaty_game_model as model
+import Treaty_game_equations_solver as solver
+import Treaty_simulation as simulation
+
+BENCHMARK_VERSION = 1
+SEED = 20200101
+MIN_TIMED_REPEATS = 5 # repeats needed before the min time is compared with the baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# functions whose calls are counted, with the number of points they were evaluated on
+COUNTED = [(model.IncomeExpansion, ['NativeIncome', 'SettlerIncome', 'NativeExpan', 'SettlerExpan']),
+           (solver.IncomeExpansion, ['ComFuns', 'ComJac'])]
+
+def DefaultDP(ne_method='grid', **kwargs):
+    ie = model.IncomeExpansion(120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+    pd = model.NaivePlayerDecision(ie, 1/6, 10)
+    return model.DP(ie, pd, ne_method, **kwargs)
+
+@contextmanager
+def CountCalls(targets=COUNTED):
+    '''
+    Count the calls of the given class methods, and the points they were evaluated on, while the block runs.
+    Yield the dict of counts, keyed 'Class.method'.
+    '''
+    counts, originals = {}, []
+    def Counted(name, method):
+        def wrapper(self, *args, **kwargs):
+            counts[name]['calls'] += 1
+            counts[name]['points'] += int(np.size(args[0])) if args else 1
+            return method(self, *args, **kwargs)
+        return wrapper
+    for cls, names in targets:
+        for name in names:
+            key = cls.__name__ + '.' + name
+            if cls.__module__ != model.__name__:
+                key = cls.__module__ + '.' + key
+            counts[key] = {'calls': 0, 'points': 0}
+            originals.append((cls, name, getattr(cls, name)))
+            setattr(cls, name, Counted(key, getattr(cls, name)))
+    try:
+        yield counts
+    finally:
+        for cls, name, method in originals:
+            setattr(cls, name, method)
+
+def BenchResponseList(saving):
+    dp = DefaultDP()
+    if saving:
+        return lambda: dp.ResponseList(65, 1, 50, 50, True)
+    return lambda: dp.ResponseList(65, 1)
+
+def BenchFindNE():
+    dp = DefaultDP()
+    spendings, responses = dp.ResponseList(65, 1)
+    return lambda: [dp.FindNE(spendings, responses) for _ in range(1000)]
+
+def BenchDynamicNE():
+    dp = DefaultDP()
+    return lambda: dp.DynamicNE(65, verbose=False)
+
+def BenchSimulation():
+    dp = DefaultDP()
+    return lambda: dp.Simulation(65, 5, rng=np.random.default_rng(SEED))
+
+def BenchTreatyMatch(matches=4):
+    np.random.seed(SEED)
+    tr, treatment = simulation.DrawSubject()
+    def run():
+        np.random.seed(SEED)
+        simulation.dp.cache.Clear()
+        return simulation.TreatySimulation(65, tr, treatment, matches=matches)
+    return run
+
+def BenchFindEq():
+    return lambda: solver.find_eq(np.array([0, 100, 150, 0.5]), True)
+
+# name -> (setup returning the timed callable, default repeats, number of units the time is divided by)
+BENCHMARKS = {
+    'ResponseList': (lambda: BenchResponseList(False), 5, 1),
+    'ResponseList_saving': (lambda: BenchResponseList(True), 5, 1),
+    'FindNE': (BenchFindNE, 5, 1000),
+    'DynamicNE': (BenchDynamicNE, 1, 1),
+    'DP.Simulation': (BenchSimulation, 2, 1),
+    'TreatySimulation_per_match': (lambda: BenchTreatyMatch(4), 2, 4),
+    'find_eq': (BenchFindEq, 10, 1),
+}
+
+def RunBenchmark(name, repeats=None, min_repeats=1):
+    '''
+    Run one benchmark of BENCHMARKS, repeats times (its default repeats if None) but at least min_repeats times.
+    The timed repeats run without tracing; one more run is made under tracemalloc and CountCalls for peak memory
+    and evaluation counts, which would otherwise skew the times.
+    '''
+    setup, default_repeats, units = BENCHMARKS[name]
+    fun = setup()
+    times = []
+    for _ in range(max(repeats or default_repeats, min_repeats)):
+        start = time.perf_counter()
+        fun()
+        times.append((time.perf_counter() - start)/units)
+    tracemalloc.start()
+    with CountCalls() as counts:
+        fun()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = {key: {k: v//units for k, v in value.items()} for key, value in counts.items() if value['calls']}
+    return {'min': min(times), 'median': float(np.median(times)), 'repeats': len(times),
+            'units': units, 'peak_bytes': peak, 'counts': counts}
+
+def RunBenchmarks(names=None, repeats=None, verbose=True, min_repeats=1):
+    '''
+    Run the benchmarks (all of BENCHMARKS by default). Return a JSON-ready dict with the environment and
+    one entry per benchmark; times are seconds per call, or per match for TreatySimulation.
+    '''
+    results = {'version': BENCHMARK_VERSION, 'seed': SEED,
+               'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                               'machine': platform.machine(), 'system': platform.system()},
+               'benchmarks': {}}
+    for name in names or BENCHMARKS:
+        results['benchmarks'][name] = RunBenchmark(name, repeats, min_repeats)
+        if verbose:
+            res = results['benchmarks'][name]
+            print('{:<28} median {:10.6f}s  min {:10.6f}s  peak {:8.1f} KiB'.format(name, res['median'], res['min'], res['peak_bytes']/1024))
+    return results
+
+def CompareBaseline(results, baseline, tolerance=None):
+    '''
+    Compare results with a baseline of the same format. A benchmark regresses if its evaluation counts changed,
+    which is deterministic, and, only if tolerance is given, if its min time exceeds tolerance times the
+    baseline's. Times are only compared between runs of MIN_TIMED_REPEATS repeats or more in the same
+    environment, as they are not comparable across machines and a few repeats are too noisy.
+    Return a list of (name, message) regressions and a list of (name, message) skipped time checks.
+    '''
+    regressions, skipped = [], []
+    if tolerance is not None and results['environment'] != baseline['environment']:
+        skipped.append(('*', 'environment {} differs from the baseline {}'.format(results['environment'], baseline['environment'])))
+        tolerance = None
+    for name, res in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            continue
+        if tolerance is not None:
+            if min(res['repeats'], base['repeats']) < MIN_TIMED_REPEATS:
+                skipped.append((name, 'fewer than {} repeats'.format(MIN_TIMED_REPEATS)))
+            elif res['min'] > tolerance * base['min']:
+                regressions.append((name, 'time {:.6f}s is {:.2f}x the baseline {:.6f}s'.format(res['min'], res['min']/base['min'], base['min'])))
+        if res['counts'] != base['counts']:
+            regressions.append((name, 'evaluation counts changed: {} -> {}'.format(base['counts'], res['counts'])))
+    return regressions, skipped
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the treaty game hot paths.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeats', type=int, help='timed repeats of every benchmark')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, help='also compare min times with the baseline, allowing this slowdown '
+                        '(e.g. 1.25); every benchmark then runs at least {} times'.format(MIN_TIMED_REPEATS))
+    parser.add_argument('--save-baseline', action='store_true', help='store the results in the baseline')
+    args = parser.parse_args()
+
+    timed = args.tolerance is not None or args.save_baseline # a baseline is saved with enough repeats to compare times
+    results = RunBenchmarks(args.names, args.repeats, min_repeats=MIN_TIMED_REPEATS if timed else 1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.save_baseline:
+        if args.names and os.path.exists(args.baseline):  # update only the benchmarks that were run
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline['benchmarks'].update(results['benchmarks'])
+            results = dict(results, benchmarks=baseline['benchmarks'])
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions, skipped = CompareBaseline(results, json.load(f), args.tolerance)
+        for name, message in skipped:
+            print('time check skipped {}: {}'.format(name, message))
+        for name, message in regressions:
+            print('REGRESSION {}: {}'.format(name, message))
+        sys.exit(1 if regressions else 0)
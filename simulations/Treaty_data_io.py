@@ -0,0 +1,146 @@
+### Streaming, partitioned columnar storage of simulated experiment data ###
+
+import os
+import json
+import glob
+import shutil
+import numpy as np
+import pandas
+from Treaty_simulation import TreatyRows, DrawSubject, SIMULATION_COLUMNS
+
+STORE_VERSION = 1
+COLUMNS = ['SubId'] + SIMULATION_COLUMNS
+SCHEMA = dict({column: 'f8' for column in COLUMNS},
+              SubId='i8', Match='i4', CurrentPeriod='i4', Treatment='U7', TreatyEndingReason='U14')
+PARTITIONS = ('Treatment', 'SubId')
+PART_PATTERN = 'part-[0-9]*[0-9]' # a part directory, not a .tmp one
+
+def SimulationStream(n_subs, n_land_start=65, matches=4, rng=np.random, **kwargs):
+    '''
+    Generator version of the Treaty_simulation driver. Yield (partition, rows) once per subject, where
+    partition is {'Treatment': subject's treatment, 'SubId': id} and rows start with SubId.
+    kwargs are passed to TreatyRows.
+    '''
+    for i in range(1, n_subs+1):
+        tr, treatment = DrawSubject(rng)
+        partition = {'Treatment': str(treatment), 'SubId': 100+i}
+        yield partition, [[100+i] + row for row in TreatyRows(n_land_start, tr, treatment, matches=matches, **kwargs)]
+
+def RowsToColumns(rows):
+    '''
+    Turn rows in COLUMNS order into typed numpy columns. None/nan become '' in text columns and nan in numeric ones.
+    '''
+    columns = {}
+    for column, values in zip(COLUMNS, zip(*rows)):
+        if SCHEMA[column].startswith('U'):
+            values = ['' if value is None or value != value else value for value in values]
+        columns[column] = np.array(values, dtype=SCHEMA[column])
+    return columns
+
+class ColumnarWriter:
+    '''
+    Chunked writer of simulated rows. Rows are buffered per partition and flushed as one .npy file per column in
+    <directory>/Treatment=<t>/SubId=<id>/part-<n>/, so memory is bounded by max_rows whatever the run size and
+    values keep full precision. Parts are written to a .tmp directory and renamed, so a part either is complete or
+    is not counted; an interrupted write leaves only a .tmp directory, which the next write of that part replaces.
+
+    Parameters:
+    ----------
+    directory (str): root of the store, a schema.json is written there.
+    partition_by (tuple[str]): partition keys, a subset of PARTITIONS in that order.
+    chunk_rows (int): rows per part file of one partition.
+    max_rows (int): total buffered rows before every partition is flushed.
+    '''
+    def __init__(self, directory, partition_by=PARTITIONS, chunk_rows=50000, max_rows=500000):
+        self.directory, self.partition_by = directory, tuple(partition_by)
+        self.chunk_rows, self.max_rows = chunk_rows, max_rows
+        self.buffers, self.buffered = {}, 0
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'schema.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'schema': SCHEMA, 'columns': COLUMNS, 'partition_by': self.partition_by}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def Append(self, partition, rows):
+        key = tuple('{}={}'.format(name, partition[name]) for name in self.partition_by)
+        self.buffers.setdefault(key, []).extend(rows)
+        self.buffered += len(rows)
+        if len(self.buffers[key]) >= self.chunk_rows:
+            self.Flush(key)
+        if self.buffered >= self.max_rows:
+            self.Close()
+
+    def Flush(self, key):
+        rows = self.buffers.pop(key, [])
+        if not rows:
+            return
+        self.buffered -= len(rows)
+        path = os.path.join(self.directory, *key)
+        part = os.path.join(path, 'part-{:05d}'.format(len(glob.glob(os.path.join(path, PART_PATTERN))))) # completed parts only
+        shutil.rmtree(part + '.tmp', ignore_errors=True)
+        os.makedirs(part + '.tmp')
+        for column, values in RowsToColumns(rows).items():
+            np.save(os.path.join(part + '.tmp', column + '.npy'), values)
+        os.replace(part + '.tmp', part)
+
+    def Close(self):
+        for key in list(self.buffers):
+            self.Flush(key)
+
+def WriteStream(stream, directory, **kwargs):
+    '''
+    Drain a (partition, rows) stream such as SimulationStream into a ColumnarWriter. Return the number of rows.
+    '''
+    n_rows = 0
+    with ColumnarWriter(directory, **kwargs) as writer:
+        for partition, rows in stream:
+            writer.Append(partition, rows)
+            n_rows += len(rows)
+    return n_rows
+
+class ColumnarReader:
+    '''
+    Lazy reader of a ColumnarWriter store. Nothing is read until Parts or ToPandas is called, and then only
+    the requested columns of the matching partitions, memory-mapped.
+
+    Parameters:
+    ----------
+    directory (str): root of the store.
+    '''
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'schema.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError('Store version {} is not supported!'.format(meta['version']))
+        self.directory, self.columns, self.partition_by = directory, meta['columns'], tuple(meta['partition_by'])
+
+    def PartPaths(self, **filters):
+        pattern = [name + '=' + str(filters.get(name, '*')) for name in self.partition_by]
+        return sorted(glob.glob(os.path.join(self.directory, *pattern, PART_PATTERN)))
+
+    def Parts(self, columns=None, **filters):
+        '''
+        Yield one dict of memory-mapped numpy columns per part. filters select partitions, e.g. Treatment='annuity'.
+        '''
+        columns = self.columns if columns is None else columns
+        for part in self.PartPaths(**filters):
+            yield {column: np.load(os.path.join(part, column + '.npy'), mmap_mode='r') for column in columns}
+
+    def ToPandas(self, columns=None, **filters):
+        '''
+        Load the selected columns and partitions as one DataFrame, text columns with None for missing values.
+        '''
+        columns = self.columns if columns is None else columns
+        frames = [pandas.DataFrame({column: np.asarray(values) for column, values in part.items()})
+                  for part in self.Parts(columns, **filters)]
+        if not frames:
+            return pandas.DataFrame(columns=columns)
+        data = pandas.concat(frames, ignore_index=True)
+        for column in columns:
+            if SCHEMA[column].startswith('U'):
+                data[column] = data[column].astype(object).where(data[column] != '', None)
+        return data
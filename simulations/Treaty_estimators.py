@@ -0,0 +1,219 @@
+### Vectorized maximum-likelihood estimators for the treaty-length and profit models ###
+
+import numpy as np
+import pandas
+from scipy.special import expit, gammaln, logsumexp
+
+def Batch(y, x=None):
+    '''
+    Return y as a float (datasets, observations) array and x broadcast to it (zeros if None).
+    '''
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.zeros(y.shape) if x is None else np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    return y, x
+
+class FitResult:
+    '''
+    Estimates of one model on a batch of datasets: params and se are (datasets, parameters) arrays,
+    loglik, converged and iterations have one entry per dataset.
+    '''
+    def __init__(self, names, params, se, loglik, converged, iterations):
+        self.names, self.params, self.se = names, params, se
+        self.loglik, self.converged, self.iterations = loglik, converged, iterations
+
+    def ToFrame(self):
+        data = pandas.DataFrame(self.params, columns=self.names)
+        for j, name in enumerate(self.names):
+            data[name + '_se'] = self.se[:, j]
+        data['loglik'], data['converged'] = self.loglik, self.converged
+        return data
+
+class RegressionModel:
+    '''
+    Maximum likelihood for a model whose parameter depends on one covariate through eta = beta0 + beta1 * x, as in
+    the notebooks' PyMC3 models with Institute/IfSettler. Fitted by Newton-Raphson on the analytic score and
+    Hessian for a whole batch of datasets at once, with step halving; with a binary covariate the start from
+    the two group means is already the maximum. Subclasses give the log-likelihood and its first two
+    derivatives in eta (Terms), the eta matching a mean (MeanEta) and a sampler (Sample).
+    '''
+    names = ['beta0', 'beta1']
+
+    def LogLik(self, beta, y, x):
+        return self.Terms(beta[:, :1] + beta[:, 1:] * x, y)[0].sum(axis=1)
+
+    def Score(self, beta, y, x):
+        d1 = self.Terms(beta[:, :1] + beta[:, 1:] * x, y)[1]
+        return np.stack([d1.sum(axis=1), (d1 * x).sum(axis=1)], axis=1)
+
+    def Hessian(self, beta, y, x):
+        d2 = self.Terms(beta[:, :1] + beta[:, 1:] * x, y)[2]
+        h00, h01, h11 = d2.sum(axis=1), (d2 * x).sum(axis=1), (d2 * x**2).sum(axis=1)
+        return np.stack([np.stack([h00, h01], axis=1), np.stack([h01, h11], axis=1)], axis=1)
+
+    def Start(self, y, x):
+        binary = np.all((x == 0) | (x == 1), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_0 = np.sum(y * (x == 0), axis=1)/np.sum(x == 0, axis=1)
+            mean_1 = np.sum(y * (x == 1), axis=1)/np.sum(x == 1, axis=1)
+            eta_0, eta_1, eta = self.MeanEta(mean_0), self.MeanEta(mean_1), self.MeanEta(y.mean(axis=1))
+        beta = np.where(binary[:, None], np.stack([eta_0, eta_1 - eta_0], axis=1), np.stack([eta, 0*eta], axis=1))
+        return np.where(np.isfinite(beta), beta, np.stack([eta, 0*eta], axis=1))
+
+    def Fit(self, y, x=None, max_iter=100, tol=1e-8):
+        '''
+        Fit every row of y (one dataset per row, or a single 1-d dataset). Standard errors come from the
+        inverse of the observed information.
+        '''
+        y, x = Batch(y, x)
+        beta = self.Start(y, x)
+        loglik = self.LogLik(beta, y, x)
+        iterations = np.zeros(len(y), dtype=int)
+        with np.errstate(all='ignore'):
+            for _ in range(max_iter):
+                score = self.Score(beta, y, x)
+                active = np.isfinite(loglik) & (np.max(np.abs(score), axis=1) > tol)
+                if not np.any(active):
+                    break
+                step = np.linalg.solve(self.Hessian(beta, y, x)[active], -score[active][..., None])[..., 0]
+                t = np.ones(len(step))
+                for _ in range(30):
+                    beta_new = beta[active] + t[:, None] * step
+                    loglik_new = self.LogLik(beta_new, y[active], x[active])
+                    better = loglik_new >= loglik[active] - 1e-12
+                    if np.all(better):
+                        break
+                    t = np.where(better, t, t/2)
+                beta[active] = np.where(better[:, None], beta_new, beta[active])
+                loglik[active] = np.where(better, loglik_new, loglik[active])
+                iterations[active] += 1
+            score = self.Score(beta, y, x)
+            se = np.sqrt(np.diagonal(np.linalg.inv(-self.Hessian(beta, y, x)), axis1=1, axis2=2))
+        converged = np.isfinite(loglik) & (np.max(np.abs(score), axis=1) <= tol)
+        return FitResult(self.names, beta, se, loglik, converged, iterations)
+
+class GeometricModel(RegressionModel):
+    '''
+    y ~ Geometric(p) on 1, 2, ..., with p = expit(beta0 + beta1 * x).
+    '''
+    def Terms(self, eta, y):
+        p = expit(eta)
+        loglik = -np.logaddexp(0, -eta) + (y - 1) * -np.logaddexp(0, eta)
+        return loglik, 1 - y * p, -y * p * (1 - p)
+
+    def MeanEta(self, mean):
+        return np.log(1/(mean - 1))
+
+    def Sample(self, beta, x, size, rng):
+        return rng.geometric(expit(beta[0] + beta[1] * np.asarray(x)), size=(size, len(x)))
+
+class ExponentialModel(RegressionModel):
+    '''
+    y ~ Exponential(lam), with the identity link lam = beta0 + beta1 * x.
+    '''
+    def Terms(self, eta, y):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loglik = np.where(eta > 0, np.log(eta) - eta * y, -np.inf)
+            return loglik, 1/eta - y, -1/eta**2
+
+    def MeanEta(self, mean):
+        return 1/mean
+
+    def Sample(self, beta, x, size, rng):
+        return rng.exponential(1/(beta[0] + beta[1] * np.asarray(x)), size=(size, len(x)))
+
+class PoissonModel(RegressionModel):
+    '''
+    y ~ Poisson(lam), with lam = exp(beta0 + beta1 * x).
+    '''
+    def Terms(self, eta, y):
+        lam = np.exp(eta)
+        return y * eta - lam - gammaln(y + 1), y - lam, -lam
+
+    def MeanEta(self, mean):
+        return np.log(mean)
+
+    def Sample(self, beta, x, size, rng):
+        return rng.poisson(np.exp(beta[0] + beta[1] * np.asarray(x)), size=(size, len(x)))
+
+class NegativeBinomialModel(RegressionModel):
+    '''
+    y ~ NegativeBinomial(n, p) on 0, 1, ..., with p = 1/(1 + exp(beta0 + beta1 * x)) and n fixed (1 in the notebook).
+    '''
+    def __init__(self, n=1):
+        self.n = n
+
+    def Terms(self, eta, y):
+        n, q = self.n, expit(eta)
+        loglik = gammaln(y + n) - gammaln(n) - gammaln(y + 1) + y * eta - (n + y) * np.logaddexp(0, eta)
+        return loglik, y - (n + y) * q, -(n + y) * q * (1 - q)
+
+    def MeanEta(self, mean):
+        return np.log(mean/self.n)
+
+    def Sample(self, beta, x, size, rng):
+        return rng.negative_binomial(self.n, 1/(1 + np.exp(beta[0] + beta[1] * np.asarray(x))), size=(size, len(x)))
+
+class MixtureModel:
+    '''
+    y ~ w0 Geometric(p0) + w1 Geometric(p1) on 1, 2, ..., with p0 < p1 as in the notebook's ordered betas.
+    Fitted by EM for a whole batch of datasets at once; the covariate is not used.
+    '''
+    names = ['p0', 'p1', 'w0', 'w1']
+
+    def Components(self, p, y):
+        return np.log(p[:, :, None]) + (y[:, None, :] - 1) * np.log1p(-p[:, :, None]) # (datasets, 2, observations)
+
+    def LogLik(self, params, y):
+        log_f = self.Components(params[:, :2], y) + np.log(params[:, 2:, None])
+        return logsumexp(log_f, axis=1).sum(axis=1)
+
+    def Fit(self, y, x=None, max_iter=2000, tol=1e-10):
+        '''
+        EM started from the two halves of each dataset split at its median. Standard errors are nan,
+        use ParametricBootstrap.
+        '''
+        y, _ = Batch(y)
+        high = y > np.median(y, axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_high = np.sum(y * high, axis=1)/np.sum(high, axis=1)
+            mean_low = np.sum(y * ~high, axis=1)/np.sum(~high, axis=1)
+        p = np.clip(np.stack([1/np.where(np.isfinite(mean_high), mean_high, 2 * y.mean(axis=1)), 1/mean_low], axis=1), 1e-6, 1 - 1e-6)
+        w = np.full((len(y), 2), 0.5)
+        loglik = np.full(len(y), -np.inf)
+        converged = np.zeros(len(y), dtype=bool)
+        iterations = np.zeros(len(y), dtype=int)
+        active = np.arange(len(y)) # only the datasets still moving are updated
+        for _ in range(max_iter):
+            log_f = self.Components(p[active], y[active]) + np.log(w[active, :, None])
+            total = logsumexp(log_f, axis=1)
+            loglik_new = total.sum(axis=1)
+            done = np.abs(loglik_new - loglik[active]) <= tol * np.abs(loglik_new)
+            loglik[active], converged[active] = loglik_new, done
+            r = np.exp(log_f[~done] - total[~done, None, :]) # responsibilities
+            active = active[~done]
+            if len(active) == 0:
+                break
+            w[active] = r.mean(axis=2)
+            p[active] = np.clip(r.sum(axis=2)/(r * y[active, None, :]).sum(axis=2), 1e-12, 1 - 1e-12)
+            iterations[active] += 1
+        order = np.argsort(p, axis=1)
+        rows = np.arange(len(y))[:, None]
+        params = np.concatenate([p[rows, order], w[rows, order]], axis=1)
+        return FitResult(self.names, params, np.full(params.shape, np.nan), loglik, converged, iterations)
+
+    def Sample(self, params, x, size, rng):
+        n = len(x)
+        component = rng.random((size, n)) < params[3]
+        return rng.geometric(np.where(component, params[1], params[0]))
+
+def ParametricBootstrap(model, y, x=None, n_boot=2000, rng=None):
+    '''
+    Fit model to one dataset, draw n_boot datasets from the fit and refit them all in one batch.
+    Return the fit, the FitResult of the resamples and the bootstrap standard errors of the parameters.
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    y, x = Batch(y, x)
+    fit = model.Fit(y, x)
+    samples = model.Sample(fit.params[0], x[0], n_boot, rng)
+    boot = model.Fit(samples, x[0])
+    return fit, boot, np.nanstd(boot.params[boot.converged], axis=0, ddof=1)
@@ -0,0 +1,141 @@
+### Backward induction for the treaty game over a land grid ###
+
+import numpy as np
+from Treaty_game_model import DP
+
+def StageEquilibrium(ie, lands, n_value, s_value, continuation, actions=101, previous=None, eps=0.):
+    '''
+    Equilibrium of one period at every land node, when the game goes on with probability continuation into a
+    period whose values are n_value and s_value (on lands). Both players choose among actions spendings from 0 to
+    their income; the payoffs of every pair are computed at once for all nodes, and the pairs whose regret (what
+    the better-off deviator gains by its best deviation on the grid) is within eps of the smallest are the
+    equilibria: exact ones of the grid game if there are some. The one with the lowest native spending is kept,
+    or, given previous (the native and settler action indices chosen before, one per node), the one closest to it.
+    Return native spending, settler spending, next period's native land, the regret and the action indices,
+    one per node.
+    '''
+    land = lands[:, None, None]
+    fractions = np.linspace(0, 1, actions)
+    n_spending = ie.NativeIncome(land) * fractions[None, :, None] # native along axis 1, settler along axis 2
+    s_spending = ie.SettlerIncome(100 - land) * fractions[None, None, :]
+    land_next = np.clip(land + ie.NativeExpan(n_spending, land) - ie.SettlerExpan(s_spending, 100 - land), lands[0], lands[-1])
+    n_payoff = -n_spending + continuation * np.interp(land_next, lands, n_value)
+    s_payoff = -s_spending + continuation * np.interp(land_next, lands, s_value)
+    regret = np.maximum(n_payoff.max(axis=1, keepdims=True) - n_payoff, s_payoff.max(axis=2, keepdims=True) - s_payoff)
+    regret = regret.reshape(len(lands), -1)
+    if previous is None:
+        best = regret.argmin(axis=1)
+    else:
+        i, j = np.divmod(np.arange(actions**2), actions)
+        distance = np.abs(i[None] - previous[0][:, None]) + np.abs(j[None] - previous[1][:, None])
+        best = np.where(regret <= regret.min(axis=1, keepdims=True) + eps, distance, np.inf).argmin(axis=1)
+    rows, i, j = np.arange(len(lands)), best // actions, best % actions
+    return n_spending[rows, i, 0], s_spending[rows, 0, j], land_next[rows, i, j], regret[rows, best], (i, j)
+
+class PolicyTable:
+    '''
+    Policies and values found by BackwardInduction. n_spending, s_spending, land_next, regret, n_value and s_value
+    are (n_default + 1, len(lands)) arrays, row t-1 for period t; the last row is the stationary policy of every
+    period after the default ones. ie_params, prob and n_default are the game it solves. Lookup is O(1) as the
+    land grid is uniform.
+    '''
+    def __init__(self, lands, ie_params, prob, n_default, stages, tail_iterations, tail_converged):
+        self.lands, self.ie_params, self.prob, self.n_default = lands, ie_params, prob, n_default
+        self.step = lands[1] - lands[0]
+        self.n_spending, self.s_spending, self.land_next, self.regret, self.n_value, self.s_value = [np.array(field) for field in zip(*stages)]
+        self.tail_iterations, self.tail_converged = tail_iterations, tail_converged
+
+    def Lookup(self, n_land, current_p):
+        '''
+        Return [n_spending, s_spending] at native land n_land in period current_p, linear in land.
+        '''
+        row = min(current_p, self.n_default + 1) - 1
+        position = min(max((n_land - self.lands[0])/self.step, 0), len(self.lands) - 1)
+        i = min(int(position), len(self.lands) - 2)
+        w = position - i
+        return [self.n_spending[row, i] * (1 - w) + self.n_spending[row, i+1] * w,
+                self.s_spending[row, i] * (1 - w) + self.s_spending[row, i+1] * w]
+
+def Stage(ie, lands, n_value, s_value, continuation, actions, previous=None, eps=0.):
+    '''
+    One Bellman step: the stage equilibrium against the continuation values and the values it gives, as a
+    PolicyTable row, and the action indices.
+    '''
+    n_spending, s_spending, land_next, regret, choice = StageEquilibrium(ie, lands, n_value, s_value, continuation,
+                                                                         actions, previous, eps)
+    n_value = ie.NativeIncome(lands) - n_spending + continuation * np.interp(land_next, lands, n_value)
+    s_value = ie.SettlerIncome(100 - lands) - s_spending + continuation * np.interp(land_next, lands, s_value)
+    return (n_spending, s_spending, land_next, regret, n_value, s_value), choice
+
+def BackwardInduction(ie, prob, n_default, lands=np.linspace(1, 99, 197), actions=101, eps=0.05, tol=1e-6, max_iter=1000):
+    '''
+    Solve the game by backward induction instead of DP's myopic horizon multiplier. Each period a player gets its
+    income on the current land minus its spending, and the land moves by the spendings. The n_default first
+    periods and the one after them are certain, later ones happen with probability 1 - prob given the previous
+    one. After the default periods the game is stationary, so its policy is solved once by value iteration, and
+    the default periods are solved backwards from its values. Each stage keeps the eps-equilibrium closest to the
+    pair chosen in the previous iteration (or the following period): with several equilibria at a node, picking
+    afresh each time makes value iteration cycle between them. Savings are not part of the state: spending is
+    bounded by the period income, as in DP with saving=False. Return a PolicyTable.
+
+    Parameters:
+    ----------
+        ie: IncomeExpansion instance.
+        prob (float): probability to end the game in each period after the default ones.
+        n_default (int): default periods without uncertainty at the begining of the game.
+        lands (array-like): uniform grid of Native's land.
+        actions (int): spendings per player and land node in each period's game.
+        eps (float): regret above the smallest one at which a pair still counts as an equilibrium.
+        tol (float): value iteration stops when no value moves by more than tol.
+        max_iter (int): maximum number of value iterations.
+    '''
+    lands = np.asarray(lands, dtype=float)
+    if not np.allclose(np.diff(lands), lands[1] - lands[0]):
+        raise ValueError('The land grid must be uniform!')
+    tail, choice = Stage(ie, lands, np.zeros(len(lands)), np.zeros(len(lands)), 0, actions)
+    converged = False
+    for iterations in range(1, max_iter + 1):
+        previous = tail
+        tail, choice = Stage(ie, lands, previous[4], previous[5], 1 - prob, actions, choice, eps)
+        if max(np.max(np.abs(tail[4] - previous[4])), np.max(np.abs(tail[5] - previous[5]))) <= tol:
+            converged = True
+            break
+    stages = [tail]
+    for period in range(n_default, 0, -1):
+        stage, choice = Stage(ie, lands, stages[-1][4], stages[-1][5], 1, actions, choice, eps)
+        stages.append(stage)
+    return PolicyTable(lands, ie.Params(), prob, n_default, stages[::-1], iterations, converged)
+
+class BackwardDP(DP):
+    '''
+    DP whose period equilibria are read from a PolicyTable of BackwardInduction, so that DynamicNE and Simulation
+    (and TreatySimulation, if set as Treaty_simulation.dp) follow the backward-induction policies with an O(1)
+    lookup per period.
+
+    Parameters:
+    ----------
+    IE: IncomeExpansion instance.
+    PD: PlayerDecision instance, only used for its prob and n_dft.
+    policy: PolicyTable built on the same IE, PD.prob and PD.n_dft.
+    Other keyword arguments are passed to DP.
+    '''
+    def __init__(self, IE, PD, policy, **kwargs):
+        super().__init__(IE, PD, **kwargs)
+        if tuple(policy.ie_params) != tuple(IE.Params()):
+            raise ValueError('Policy table was built for other IncomeExpansion params!')
+        if policy.prob != PD.prob:
+            raise ValueError('Policy table was built for another end probability!')
+        if policy.n_default != PD.n_dft:
+            raise ValueError('Policy table was built for other default periods!')
+        self.policy = policy
+
+    def ModelKey(self):
+        lands = self.policy.lands
+        return super().ModelKey() + ('backward', lands[0], lands[-1], len(lands))
+
+    def ComputeEquilibrium(self, n_land, current_p, n_savings=None, s_savings=None, saving=False):
+        n_income = self.ie.NativeIncome(n_land)
+        s_income = self.ie.SettlerIncome(100 - n_land)
+        if saving:
+            n_income, s_income = n_income + n_savings, s_income + s_savings
+        return [np.array([0, n_income]), np.array([0, s_income])], [], self.policy.Lookup(n_land, current_p), [np.nan, True]
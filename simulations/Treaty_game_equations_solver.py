@@ -1,7 +1,6 @@
+import time
 import numpy as np
-from scipy.optimize import fsolve
-from scipy.optimize import newton_krylov
-from scipy.optimize import least_squares, minimize
+from concurrent.futures import ProcessPoolExecutor
 
 class IncomeExpansion():
     def __init__(self, A1, B1, C1, A2, B2, C2, D, E, H, gamma, beta, prob):
@@ -16,6 +15,10 @@ class IncomeExpansion():
         A1, B1, C1 = self.A1, self.B1, self.C1
         ex = np.exp(-B1*(land - C1))
         return B1 * A1 * ex/(1+ ex)**2 
+    def NativeMIDeriv(self, land):
+        A1, B1, C1 = self.A1, self.B1, self.C1
+        ex = np.exp(-B1*(land - C1))
+        return B1**2 * A1 * ex * (ex - 1)/(1+ ex)**3
     def SettlerIncome(self, land):
         A2, B2, C2 = self.A2, self.B2, self.C2 
         return A2/(1+ np.exp(-B2* (land - C2)) - A2/(1+ np.exp(B2 * C2))) 
@@ -23,18 +26,40 @@ class IncomeExpansion():
         A2, B2, C2 = self.A2, self.B2, self.C2
         ex = np.exp(-B2*(land - C2))
         return B2 * A2 * ex/(1+ ex)**2 
+    def SettlerMIDeriv(self, land):
+        A2, B2, C2 = self.A2, self.B2, self.C2
+        ex = np.exp(-B2*(land - C2))
+        return B2**2 * A2 * ex * (ex - 1)/(1+ ex)**3
     def NativeExpan(self, spending, land):
         D, H, gamma = self.D, self.H, self.gamma
         return  spending**(1 - gamma)/(land + D) * (H - land)
     def NativeExpanMG(self, spending, land):
         D, H, gamma = self.D, self.H, self.gamma
         return  spending**(-gamma)/(land + D) * (H - land) * (1 - gamma)
+    def NativeExpanMGDeriv(self, spending, land):
+        D, H, gamma = self.D, self.H, self.gamma
+        return  -spending**(-gamma - 1)/(land + D) * (H - land) * (1 - gamma) * gamma
+    def NativeExpanLand(self, spending, land):  # d NativeExpan / d land
+        D, H, gamma = self.D, self.H, self.gamma
+        return  -spending**(1 - gamma) * (H + D)/(land + D)**2
+    def NativeExpanMGLand(self, spending, land):  # d NativeExpanMG / d land
+        D, H, gamma = self.D, self.H, self.gamma
+        return  -spending**(-gamma) * (H + D)/(land + D)**2 * (1 - gamma)
     def SettlerExpan(self, spending, land):
         D, E, H, beta = self.D, self.E, self.H, self.beta
         return  spending**(1 - beta)/(land + D + E) * (H - land)
     def SettlerExpanMG(self, spending, land):
         D, E, H, beta = self.D, self.E, self.H, self.beta
         return  spending**(-beta)/(land + D + E) * (H - land) * (1 - beta)
+    def SettlerExpanMGDeriv(self, spending, land):
+        D, E, H, beta = self.D, self.E, self.H, self.beta
+        return  -spending**(-beta - 1)/(land + D + E) * (H - land) * (1 - beta) * beta
+    def SettlerExpanLand(self, spending, land):  # d SettlerExpan / d land
+        D, E, H, beta = self.D, self.E, self.H, self.beta
+        return  -spending**(1 - beta) * (H + D + E)/(land + D + E)**2
+    def SettlerExpanMGLand(self, spending, land):  # d SettlerExpanMG / d land
+        D, E, H, beta = self.D, self.E, self.H, self.beta
+        return  -spending**(-beta) * (H + D + E)/(land + D + E)**2 * (1 - beta)
     def NativeFOC(self, land, n_spending, s_spending):
         n_gain = self.NativeExpan(n_spending, land) - self.SettlerExpan(s_spending, 100 - land)
         n_foc = self.NativeMI(land + n_gain) * self.NativeExpanMG(n_spending, land) * self.periods - 1
@@ -48,20 +73,163 @@ class IncomeExpansion():
         return np.array([self.NativeFOC(land, n_spending, s_spending), 
                          self.SettlerFOC(100 - land, n_spending, s_spending), 
                          self.NativeExpan(n_spending, land) - self.SettlerExpan(s_spending, 100-land)])
+    def ComJac(self, inits):
+        '''
+        Analytic Jacobian of ComFuns with respect to (land, n_spending, s_spending), shape (3, 3) + batch shape
+        when the parameters or inits are arrays.
+        '''
+        land, n_spending, s_spending = inits
+        s_land = 100 - land
+        stack = lambda *rows: np.array(np.broadcast_arrays(*rows))
+        gain = self.NativeExpan(n_spending, land) - self.SettlerExpan(s_spending, s_land)
+        gain_grad = stack(self.NativeExpanLand(n_spending, land) + self.SettlerExpanLand(s_spending, s_land),
+                          self.NativeExpanMG(n_spending, land), -self.SettlerExpanMG(s_spending, s_land))
+        unit = np.array([1, 0, 0]).reshape((3,) + (1,)*(gain_grad.ndim - 1))
+        n_mg, s_mg = self.NativeExpanMG(n_spending, land), self.SettlerExpanMG(s_spending, s_land)
+        n_mi, s_mi = self.NativeMI(land + gain), self.SettlerMI(s_land - gain)
+        n_mi_grad = self.NativeMIDeriv(land + gain) * (unit + gain_grad)
+        s_mi_grad = self.SettlerMIDeriv(s_land - gain) * (-unit - gain_grad)
+        n_mg_grad = stack(self.NativeExpanMGLand(n_spending, land), self.NativeExpanMGDeriv(n_spending, land), 0)
+        s_mg_grad = stack(-self.SettlerExpanMGLand(s_spending, s_land), 0, self.SettlerExpanMGDeriv(s_spending, s_land))
+        return np.array([(n_mi_grad * n_mg + n_mi * n_mg_grad) * self.periods,
+                         (s_mi_grad * s_mg + s_mi * s_mg_grad) * self.periods,
+                         gain_grad])
+    def ComParamJac(self, inits):
+        '''
+        Analytic Jacobian of ComFuns with respect to the parameters (A1, B1, C1, A2, B2, C2, D, E, H, gamma, beta, prob),
+        shape (3, 12) + batch shape. With ComJac it gives the comparative statics by the implicit function theorem.
+        '''
+        land, n_spending, s_spending = inits
+        s_land = 100 - land
+        D, E, H, gamma, beta = self.D, self.E, self.H, self.gamma, self.beta
+        stack = lambda *rows: np.array(np.broadcast_arrays(zero, *rows)[1:])
+        n_exp, s_exp = self.NativeExpan(n_spending, land), self.SettlerExpan(s_spending, s_land)
+        n_mg, s_mg = self.NativeExpanMG(n_spending, land), self.SettlerExpanMG(s_spending, s_land)
+        n_z, s_z = land + n_exp - s_exp, s_land - n_exp + s_exp # land the marginal incomes are taken at
+        n_mi, s_mi = self.NativeMI(n_z), self.SettlerMI(s_z)
+        n_mi_deriv, s_mi_deriv = self.NativeMIDeriv(n_z), self.SettlerMIDeriv(s_z)
+        zero = np.zeros(np.shape(n_mi * n_mg * s_mi * s_mg * self.periods)) # full batch shape
+        # D, E, H, gamma, beta: through the expansions
+        n_exp_grad = stack(-n_exp/(land + D), zero, n_spending**(1 - gamma)/(land + D), -np.log(n_spending) * n_exp, zero)
+        s_exp_grad = stack(-s_exp/(s_land + D + E), -s_exp/(s_land + D + E), s_spending**(1 - beta)/(s_land + D + E),
+                           zero, -np.log(s_spending) * s_exp)
+        n_mg_grad = stack(-n_mg/(land + D), zero, n_spending**(-gamma) * (1 - gamma)/(land + D),
+                          -np.log(n_spending) * n_mg - n_spending**(-gamma) * (H - land)/(land + D), zero)
+        s_mg_grad = stack(-s_mg/(s_land + D + E), -s_mg/(s_land + D + E), s_spending**(-beta) * (1 - beta)/(s_land + D + E),
+                          zero, -np.log(s_spending) * s_mg - s_spending**(-beta) * (H - s_land)/(s_land + D + E))
+        gain_grad = n_exp_grad - s_exp_grad
+        expansion = [(n_mi_deriv * gain_grad * n_mg + n_mi * n_mg_grad) * self.periods,
+                     (-s_mi_deriv * gain_grad * s_mg + s_mi * s_mg_grad) * self.periods,
+                     gain_grad]
+        # A, B, C: through the marginal incomes
+        n_mi_grad = stack(n_mi/self.A1, n_mi/self.B1 + n_mi_deriv * (n_z - self.C1)/self.B1, -n_mi_deriv)
+        s_mi_grad = stack(s_mi/self.A2, s_mi/self.B2 + s_mi_deriv * (s_z - self.C2)/self.B2, -s_mi_deriv)
+        income = [np.concatenate([n_mi_grad * n_mg * self.periods, stack(zero, zero, zero)]),
+                  np.concatenate([stack(zero, zero, zero), s_mi_grad * s_mg * self.periods]),
+                  stack(*[zero]*6)]
+        # prob: through periods = (1 - prob)/prob
+        periods_grad = -(1 + self.periods)**2
+        prob = [stack(n_mi * n_mg * periods_grad), stack(s_mi * s_mg * periods_grad), stack(zero)]
+        return np.array([np.concatenate(rows) for rows in zip(income, expansion, prob)])
 
 def find_eq(params, if_eq = False):
     D, E, H, alpha = params
     ##################### A1,  B1,  C1,  A2,  B2,    C2, D,   E, H,  gamma, beta, prob
     ie = IncomeExpansion(120, 0.045, 18, 180, 0.065, 40, D, E, H, alpha, alpha, 1/6)
+    from scipy.optimize import least_squares
     z = least_squares(ie.ComFuns, np.array([40, 20, 40]), bounds=([0, 0.1, 0.1], [100, 200, 200]))
     if if_eq :
         return z.x
     else:
         return (z.x[0] - 60)**2
 
-x0 = np.array([5, 20, 120, 0.4])
-bounds = np.array([[0, 100], [10, 100], [100, 150], [0.1, 0.5]])
-res = minimize(find_eq, x0=x0, method="L-BFGS-B", bounds=bounds)
-print(res.x, res.success, res.fun)
-eq_res = find_eq(np.array(res.x), True)
-print("The resulting eq. is: ",  eq_res)
+X_START = np.array([40, 20, 40])
+X_BOUNDS = ([0, 0.1, 0.1], [100, 200, 200])
+INNER_TOL = dict(ftol=1e-14, xtol=1e-14, gtol=1e-14) # tight, so that warm starts do not stop early and blur the outer gradient
+
+class Calibration:
+    '''
+    Calibrate (D, E, H, alpha) so that the equilibrium land of ComFuns hits target_land, as find_eq + minimize do.
+    Inner solves use the analytic Jacobian ComJac, are memoized by parameter vector and start from the solution
+    of the nearest parameter vector solved so far (falling back to X_START if that does not reach a root).
+
+    Parameters:
+    ----------
+    bounds (array-like): box of (D, E, H, alpha).
+    target_land (float): Native's equilibrium land to hit.
+    decimals (int): parameter vectors are rounded to this many decimals in the memo.
+    '''
+    def __init__(self, bounds, target_land=60, decimals=10):
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.target_land, self.decimals = target_land, decimals
+        self.memo = {}
+        self.inner_solves = 0
+    def Model(self, params):
+        D, E, H, alpha = params
+        return IncomeExpansion(120, 0.045, 18, 180, 0.065, 40, D, E, H, alpha, alpha, 1/6)
+    def WarmStart(self, params):
+        if not self.memo:
+            return X_START
+        scale = self.bounds[:, 1] - self.bounds[:, 0]
+        solved = np.array(list(self.memo.keys()))
+        nearest = np.argmin(np.sum(((solved - params)/scale)**2, axis=1))
+        return self.memo[tuple(solved[nearest])]
+    def Solve(self, params):
+        key = tuple(np.round(params, self.decimals))
+        if key in self.memo:
+            return self.memo[key]
+        ie = self.Model(params)
+        from scipy.optimize import least_squares
+        z = least_squares(ie.ComFuns, self.WarmStart(np.array(key)), jac=ie.ComJac, bounds=X_BOUNDS, **INNER_TOL)
+        self.inner_solves += 1
+        if z.cost > 1e-12:
+            z = least_squares(ie.ComFuns, X_START, jac=ie.ComJac, bounds=X_BOUNDS, **INNER_TOL)
+            self.inner_solves += 1
+        self.memo[key] = z.x
+        return z.x
+    def Objective(self, params):
+        return (self.Solve(params)[0] - self.target_land)**2
+    def Run(self, x0):
+        '''
+        One L-BFGS-B search from x0. Return scipy's OptimizeResult with the equilibrium, inner_solves and time added.
+        '''
+        from scipy.optimize import minimize
+        start, inner_solves = time.time(), self.inner_solves
+        res = minimize(self.Objective, x0=x0, method="L-BFGS-B", bounds=self.bounds)
+        res.eq = self.Solve(res.x)
+        res.inner_solves, res.time = self.inner_solves - inner_solves, time.time() - start
+        return res
+
+def calibration_run(task):
+    bounds, target_land, x0 = task
+    return Calibration(bounds, target_land).Run(x0)
+
+def calibrate(bounds, x0=None, n_starts=8, target_land=60, seed=None, workers=1):
+    '''
+    Multi-start calibration: run Calibration.Run from x0 (if given) and from n_starts points drawn uniformly in
+    the bounds box, across a process pool when workers > 1. Return the best OptimizeResult, with the list of
+    all runs (starts), the total number of inner solves and the wall time added.
+    '''
+    from scipy.optimize import OptimizeResult
+    start = time.time()
+    bounds = np.asarray(bounds, dtype=float)
+    starts = np.random.default_rng(seed).uniform(bounds[:, 0], bounds[:, 1], size=(n_starts, len(bounds)))
+    if x0 is not None:
+        starts = np.vstack([x0, starts])
+    tasks = [(bounds, target_land, x) for x in starts]
+    if workers == 1:
+        runs = list(map(calibration_run, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            runs = list(pool.map(calibration_run, tasks))
+    best = min(runs, key=lambda res: res.fun)
+    return OptimizeResult(best, starts=runs, inner_solves=sum(res.inner_solves for res in runs), time=time.time() - start)
+
+if __name__ == "__main__":
+    from scipy.optimize import minimize
+    x0 = np.array([5, 20, 120, 0.4])
+    bounds = np.array([[0, 100], [10, 100], [100, 150], [0.1, 0.5]])
+    res = minimize(find_eq, x0=x0, method="L-BFGS-B", bounds=bounds)
+    print(res.x, res.success, res.fun)
+    eq_res = find_eq(np.array(res.x), True)
+    print("The resulting eq. is: ",  eq_res)
@@ -1,15 +1,96 @@
 ### Code to solve the treaty game ###
 
 import numpy as np
-from scipy.optimize import fminbound
-import matplotlib.pyplot as plt
 import time
+import json
+import math
+import copy
+from collections import OrderedDict
+
+RESPONSE_METHODS = ('fminbound', 'golden', 'newton')
+NE_METHODS = ('grid', 'exact', 'direct')
+
+def GoldenSectionSearch(fun, lower, upper, xtol=1e-5, maxiter=500):
+    '''
+    Bounded golden-section search run on a whole array of intervals at once.
+    Return the minimizer of fun on [lower, upper] for every element.
+    
+    Parameters:
+    ----------
+    fun: vectorized objective, maps an array of points to an array of values.
+    lower, upper (array-like): bounds of each search interval, broadcast together.
+    xtol (float): absolute tolerance on the minimizer, the same default as fminbound.
+    maxiter (int): maximum number of objective evaluations after the first two.
+    '''
+    invphi = (np.sqrt(5) - 1)/2
+    a, b = np.broadcast_arrays(np.asarray(lower, dtype=float), np.asarray(upper, dtype=float))
+    a, b = a.copy(), b.copy()
+    c = b - invphi * (b - a)
+    d = a + invphi * (b - a)
+    fc, fd = fun(c), fun(d)
+    n = 0
+    while n < maxiter and np.any(b - a > xtol):
+        left = fc < fd # minimizer lies in [a, d]
+        b = np.where(left, d, b)
+        a = np.where(left, a, c)
+        x_new = np.where(left, b - invphi * (b - a), a + invphi * (b - a))
+        f_new = fun(x_new)
+        c, d = np.where(left, x_new, d), np.where(left, c, x_new)
+        fc, fd = np.where(left, f_new, fd), np.where(left, fc, f_new)
+        n += 1
+    return np.where(fc < fd, c, d)
+
+def SafeguardedNewton(foc, dfoc, lower, upper, xtol=1e-5, maxiter=100):
+    '''
+    Solve the first-order condition foc = 0 on [lower, upper] for a whole array of intervals at once.
+    Newton steps on the analytic derivative dfoc, falling back to bisection whenever a step leaves
+    the bracket. Return lower where foc(lower) <= 0 and upper where foc(upper) >= 0 (corner solutions).
+    
+    Parameters:
+    ----------
+    foc: vectorized marginal profit, positive below the best response and negative above it.
+    dfoc: vectorized derivative of foc.
+    lower, upper (array-like): bounds of each search interval, broadcast together.
+    xtol (float): absolute tolerance on the root.
+    maxiter (int): maximum number of Newton/bisection steps.
+    '''
+    lo, hi = np.broadcast_arrays(np.asarray(lower, dtype=float), np.asarray(upper, dtype=float))
+    lo, hi = lo.copy(), hi.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_lo, f_hi = foc(lo), foc(hi)
+    lower_corner = ~(f_lo > 0) # also catches nan, e.g. no expansion possible at all
+    upper_corner = ~lower_corner & (f_hi >= 0)
+    active = ~(lower_corner | upper_corner) & (hi - lo > xtol)
+    x = np.where(upper_corner, hi, np.where(lower_corner, lo, (lo + hi)/2))
+    n = 0
+    while n < maxiter and np.any(active):
+        f, df = foc(x), dfoc(x)
+        lo = np.where(active & (f > 0), x, lo)
+        hi = np.where(active & (f <= 0), x, hi)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_newton = x - f/df
+        newton_ok = (x_newton > lo) & (x_newton < hi)
+        x_new = np.where(newton_ok, x_newton, (lo + hi)/2)
+        step = np.abs(x_new - x)
+        x = np.where(active, x_new, x)
+        active = active & (step > xtol) & (hi - lo > xtol)
+        n += 1
+    return x
+
+def MergeGrid(points, values, new_points, new_values):
+    '''
+    Insert new_points (and their values) into the sorted grid points. Return the merged, sorted points and values.
+    '''
+    points, values = np.concatenate([points, new_points]), np.concatenate([values, new_values])
+    order = np.argsort(points, kind='stable')
+    return points[order], values[order]
 
 class GraphPlot:
     def __init__(self, begin, end, grids):
         self.xvalues = np.linspace(begin, end, grids)
         
     def IncomeGraph(self, yvalues_list, xlabel = 'Land', ylabel = 'Profit'):
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize = (9, 6))
         ax.set(title = str(xlabel) + ' v.s. ' + str(ylabel), xlabel = str(xlabel), ylabel = str(ylabel))
         labels = ['Native', 'Settler', 'Total']
@@ -20,6 +101,7 @@ class GraphPlot:
         plt.show()
         
     def CostProfit(self, yvalues, xlabel = 'Land', ylabel = 'Income/cost'):
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize = (9, 6))
         ax.set(title = str(xlabel) + ' v.s. ' + str(ylabel), xlabel = str(xlabel), ylabel = str(ylabel))
         labels = ['Native_MI', 'Settler_MI', 'Native_MC', 'Settler_MC']
@@ -30,6 +112,7 @@ class GraphPlot:
         plt.show()  
         
     def LandChange(self, yvalues, xlabel = 'Period', ylabel = 'Land'):
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize = (9, 6))
         ax.set(title = str(ylabel) + ' v.s. ' + str(xlabel), xlabel = str(xlabel), ylabel = str(ylabel))
         labels = ['Native', 'Settler']
@@ -41,6 +124,7 @@ class GraphPlot:
         plt.show()  
         
     def BestResponse(self, xvalues, yvalues, eq_spending): #[n_income_list, s_income_list], [s_best_spending, n_best_spending]
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize = (9, 6))
         ax.set(title = 'Best Spending Decision', xlabel = 'Native', ylabel = 'Settler')        
         labels = ['Settler', 'Native']
@@ -63,11 +147,26 @@ class IncomeExpansion:
     gamma: Additional params for Native's expansion.
     H, beta: Additional params for Settler's expansion.
 
+    Attributes:
+    ----------
+    global_efficiency: Settler's land maximizing the total income, computed on first use.
+
     '''
     def __init__(self, A1, B1, C1, A2, B2, C2, D, E, H, gamma, beta):
         self.A1, self.B1, self.C1 = A1, B1, C1
         self.D, self.E, self.H, self.gamma, self.beta = D, E, H, gamma, beta
         self.A2, self.B2, self.C2 = A2, B2, C2
+        self._global_efficiency = None
+
+    @property
+    def global_efficiency(self):
+        if self._global_efficiency is None:
+            from scipy.optimize import fminbound
+            self._global_efficiency = 100 - fminbound(lambda land: -self.TotalIncome(land), 0, 100)
+        return self._global_efficiency
+
+    def Params(self):
+        return (self.A1, self.B1, self.C1, self.A2, self.B2, self.C2, self.D, self.E, self.H, self.gamma, self.beta)
         
     def NativeIncome(self, land):
         A1, B1, C1 = self.A1, self.B1, self.C1
@@ -77,16 +176,68 @@ class IncomeExpansion:
         A2, B2, C2 = self.A2, self.B2, self.C2 
         return A2/(1+ np.exp(-B2* (land - C2))) - A2/(1+ np.exp(B2 * C2)) 
 
+    def TotalIncome(self, n_land):
+        return self.NativeIncome(n_land) + self.SettlerIncome(100 - n_land)
+
+    def NativeMI(self, land):
+        A1, B1, C1 = self.A1, self.B1, self.C1
+        ex = np.exp(-B1*(land - C1))
+        return B1 * A1 * ex/(1+ ex)**2
+
+    def NativeMIDeriv(self, land):
+        A1, B1, C1 = self.A1, self.B1, self.C1
+        ex = np.exp(-B1*(land - C1))
+        return B1**2 * A1 * ex * (ex - 1)/(1+ ex)**3
+
+    def SettlerMI(self, land):
+        A2, B2, C2 = self.A2, self.B2, self.C2
+        ex = np.exp(-B2*(land - C2))
+        return B2 * A2 * ex/(1+ ex)**2
+
+    def SettlerMIDeriv(self, land):
+        A2, B2, C2 = self.A2, self.B2, self.C2
+        ex = np.exp(-B2*(land - C2))
+        return B2**2 * A2 * ex * (ex - 1)/(1+ ex)**3
+
     def NativeExpan(self, spending, land):
         D, H, gamma = self.D, self.H, self.gamma
         return  spending**(1 - gamma)/(land + D) * (H - land)
+
+    def NativeExpanMG(self, spending, land):
+        D, H, gamma = self.D, self.H, self.gamma
+        return  spending**(-gamma)/(land + D) * (H - land) * (1 - gamma)
+
+    def NativeExpanMGDeriv(self, spending, land):
+        D, H, gamma = self.D, self.H, self.gamma
+        return  -spending**(-gamma - 1)/(land + D) * (H - land) * (1 - gamma) * gamma
  
     def SettlerExpan(self, spending, land):
         D, E, H, beta = self.D, self.E, self.H, self.beta
         return  spending**(1 - beta)/(land + D + E) * (H - land)
 
+    def SettlerExpanMG(self, spending, land):
+        D, E, H, beta = self.D, self.E, self.H, self.beta
+        return  spending**(-beta)/(land + D + E) * (H - land) * (1 - beta)
+
+    def SettlerExpanMGDeriv(self, spending, land):
+        D, E, H, beta = self.D, self.E, self.H, self.beta
+        return  -spending**(-beta - 1)/(land + D + E) * (H - land) * (1 - beta) * beta
+
+
+class TracedObjectives:
+    '''
+    Mixin of PlayerDecision and NaivePlayerDecision handing the objective functions to the optimizers.
+    '''
+    def Objectives(self, *funs):
+         '''
+         Return funs as they are, or wrapped so that the tracer counts one optimizer call and their evaluations.
+         '''
+         if self.tracer is None:
+             return funs
+         self.tracer.Count('optimizer_calls')
+         return [self.tracer.Counted('objective_evals', fun) for fun in funs]
 
-class PlayerDecision:
+class PlayerDecision(TracedObjectives):
     '''
     Several functions calculating player's reponse and profit.
     
@@ -95,11 +246,20 @@ class PlayerDecision:
     IE: IncomeExpansion instance.
     prob: probability to end the game in each period.
     n_default: default periods without uncertainty at the begining of the game.
+    method: best-response solver, 'fminbound' (one scalar search per point), 'golden'
+            (one vectorized golden-section search over every point, agrees with fminbound within 1e-4)
+            or 'newton' (vectorized safeguarded Newton on the analytic first-order condition).
+    tracer: optional Tracer counting optimizer calls and objective evaluations.
     '''
-    def __init__(self, IE, prob, n_default):
+    def __init__(self, IE, prob, n_default, method='fminbound', tracer=None):
+         if method not in RESPONSE_METHODS:
+             raise ValueError('Unknown best-response method: {}'.format(method))
          self.ie = IE
+         self.prob = prob
          self.periods = int((1 - prob)/prob)
          self.n_dft = n_default
+         self.method = method
+         self.tracer = tracer
          
     def NativeProfit(self, land, n_spending, s_spending, current_p):
          land_diff = self.ie.NativeExpan(n_spending, land) - self.ie.SettlerExpan(s_spending, 100-land)
@@ -109,6 +269,19 @@ class PlayerDecision:
          else:
              n_profit = revenue * self.periods - n_spending
          return n_profit
+
+    def Horizon(self, current_p):
+        return self.n_dft - current_p + self.periods if current_p <= self.n_dft else self.periods
+
+    def NativeFOC(self, land, n_spending, s_spending, current_p):
+        n_gain = self.ie.NativeExpan(n_spending, land) - self.ie.SettlerExpan(s_spending, 100-land)
+        return self.ie.NativeMI(land + n_gain) * self.ie.NativeExpanMG(n_spending, land) * self.Horizon(current_p) - 1
+
+    def NativeFOCDeriv(self, land, n_spending, s_spending, current_p):
+        n_gain = self.ie.NativeExpan(n_spending, land) - self.ie.SettlerExpan(s_spending, 100-land)
+        mg = self.ie.NativeExpanMG(n_spending, land)
+        return (self.ie.NativeMIDeriv(land + n_gain) * mg**2
+                + self.ie.NativeMI(land + n_gain) * self.ie.NativeExpanMGDeriv(n_spending, land)) * self.Horizon(current_p)
      
     def NativeResponse(self, land, s_spending, current_p, n_savings):
         if n_savings == None:
@@ -117,7 +290,20 @@ class PlayerDecision:
             income = self.ie.NativeIncome(land) + n_savings
         income = self.ie.NativeIncome(land)
         Sfun = lambda n_spending: self.NativeProfit(land, n_spending, s_spending, current_p)
-        return fminbound(lambda s: -Sfun(s), 0, income)
+        from scipy.optimize import fminbound
+        return fminbound(*self.Objectives(lambda s: -Sfun(s)), 0, income)
+
+    def NativeResponses(self, land, s_spendings, current_p, n_savings):
+        s_spendings = np.asarray(s_spendings, dtype=float)
+        if self.method == 'fminbound':
+            return np.array([self.NativeResponse(land, s_spending, current_p, n_savings) for s_spending in s_spendings])
+        income = self.ie.NativeIncome(land)
+        if self.method == 'newton':
+            return SafeguardedNewton(*self.Objectives(lambda s: self.NativeFOC(land, s, s_spendings, current_p),
+                                                      lambda s: self.NativeFOCDeriv(land, s, s_spendings, current_p)),
+                                     0, np.full_like(s_spendings, income))
+        Sfun = lambda n_spending: self.NativeProfit(land, n_spending, s_spendings, current_p)
+        return GoldenSectionSearch(*self.Objectives(lambda s: -Sfun(s)), 0, np.full_like(s_spendings, income))
      
     def SettlerProfit(self, land, n_spending, s_spending, current_p):
          land_diff = self.ie.SettlerExpan(s_spending, land) - self.ie.NativeExpan(n_spending, 100 - land)
@@ -127,6 +313,16 @@ class PlayerDecision:
          else:
              s_profit = revenue * self.periods - s_spending
          return s_profit
+
+    def SettlerFOC(self, land, n_spending, s_spending, current_p):
+        s_gain = self.ie.SettlerExpan(s_spending, land) - self.ie.NativeExpan(n_spending, 100 - land)
+        return self.ie.SettlerMI(land + s_gain) * self.ie.SettlerExpanMG(s_spending, land) * self.Horizon(current_p) - 1
+
+    def SettlerFOCDeriv(self, land, n_spending, s_spending, current_p):
+        s_gain = self.ie.SettlerExpan(s_spending, land) - self.ie.NativeExpan(n_spending, 100 - land)
+        mg = self.ie.SettlerExpanMG(s_spending, land)
+        return (self.ie.SettlerMIDeriv(land + s_gain) * mg**2
+                + self.ie.SettlerMI(land + s_gain) * self.ie.SettlerExpanMGDeriv(s_spending, land)) * self.Horizon(current_p)
      
     def SettlerResponse(self, land, n_spending, current_p, s_savings):
         if s_savings == None:
@@ -135,10 +331,23 @@ class PlayerDecision:
             income = self.ie.SettlerIncome(land) + s_savings
         income = self.ie.SettlerIncome(land)
         Sfun = lambda s_spending: self.SettlerProfit(land, n_spending, s_spending, current_p)
-        return fminbound(lambda s: -Sfun(s), 0, income)
+        from scipy.optimize import fminbound
+        return fminbound(*self.Objectives(lambda s: -Sfun(s)), 0, income)
+
+    def SettlerResponses(self, land, n_spendings, current_p, s_savings):
+        n_spendings = np.asarray(n_spendings, dtype=float)
+        if self.method == 'fminbound':
+            return np.array([self.SettlerResponse(land, n_spending, current_p, s_savings) for n_spending in n_spendings])
+        income = self.ie.SettlerIncome(land)
+        if self.method == 'newton':
+            return SafeguardedNewton(*self.Objectives(lambda s: self.SettlerFOC(land, n_spendings, s, current_p),
+                                                      lambda s: self.SettlerFOCDeriv(land, n_spendings, s, current_p)),
+                                     0, np.full_like(n_spendings, income))
+        Sfun = lambda s_spending: self.SettlerProfit(land, n_spendings, s_spending, current_p)
+        return GoldenSectionSearch(*self.Objectives(lambda s: -Sfun(s)), 0, np.full_like(n_spendings, income))
 
 
-class NaivePlayerDecision:
+class NaivePlayerDecision(TracedObjectives):
     '''
     Several functions calculating player's reponse and profit in a naive sense.
 
@@ -147,12 +356,19 @@ class NaivePlayerDecision:
     IE: IncomeExpansion instance.
     prob: probability to end the game in each period.
     n_default: default periods without uncertainty at the begining of the game.
+    method: best-response solver, 'fminbound', 'golden' or 'newton' (see PlayerDecision).
+    tracer: optional Tracer counting optimizer calls and objective evaluations.
     '''
 
-    def __init__(self, IE, prob, n_default):
+    def __init__(self, IE, prob, n_default, method='fminbound', tracer=None):
+        if method not in RESPONSE_METHODS:
+            raise ValueError('Unknown best-response method: {}'.format(method))
         self.ie = IE
+        self.prob = prob
         self.periods = int((1 - prob)/prob)
         self.n_dft = n_default
+        self.method = method
+        self.tracer = tracer
 
     def NativeProfit(self, land, n_spending, s_spending, current_p):
         land_diff = self.ie.NativeExpan(n_spending, land) 
@@ -160,13 +376,38 @@ class NaivePlayerDecision:
         n_profit = revenue - n_spending
         return n_profit
 
+    def NativeFOC(self, land, n_spending, s_spending, current_p):
+        n_gain = self.ie.NativeExpan(n_spending, land)
+        return self.ie.NativeMI(land + n_gain) * self.ie.NativeExpanMG(n_spending, land) - 1
+
+    def NativeFOCDeriv(self, land, n_spending, s_spending, current_p):
+        n_gain = self.ie.NativeExpan(n_spending, land)
+        mg = self.ie.NativeExpanMG(n_spending, land)
+        return self.ie.NativeMIDeriv(land + n_gain) * mg**2 + self.ie.NativeMI(land + n_gain) * self.ie.NativeExpanMGDeriv(n_spending, land)
+
     def NativeResponse(self, land, s_spending, current_p, n_savings):
         if n_savings == None:
             income = self.ie.NativeIncome(land)
         else:
             income = self.ie.NativeIncome(land) + n_savings
         Sfun = lambda n_spending: self.NativeProfit(land, n_spending, s_spending, current_p)
-        return fminbound(lambda s: -Sfun(s), 0, income)
+        from scipy.optimize import fminbound
+        return fminbound(*self.Objectives(lambda s: -Sfun(s)), 0, income)
+
+    def NativeResponses(self, land, s_spendings, current_p, n_savings):
+        s_spendings = np.asarray(s_spendings, dtype=float)
+        if self.method == 'fminbound':
+            return np.array([self.NativeResponse(land, s_spending, current_p, n_savings) for s_spending in s_spendings])
+        if n_savings == None:
+            income = self.ie.NativeIncome(land)
+        else:
+            income = self.ie.NativeIncome(land) + n_savings
+        if self.method == 'newton':
+            return SafeguardedNewton(*self.Objectives(lambda s: self.NativeFOC(land, s, s_spendings, current_p),
+                                                      lambda s: self.NativeFOCDeriv(land, s, s_spendings, current_p)),
+                                     0, np.full_like(s_spendings, income))
+        Sfun = lambda n_spending: self.NativeProfit(land, n_spending, s_spendings, current_p)
+        return GoldenSectionSearch(*self.Objectives(lambda s: -Sfun(s)), 0, np.full_like(s_spendings, income))
 
     def SettlerProfit(self, land, n_spending, s_spending, current_p):
         land_diff = self.ie.SettlerExpan(s_spending, land)
@@ -174,14 +415,296 @@ class NaivePlayerDecision:
         s_profit = revenue - s_spending
         return s_profit
 
+    def SettlerFOC(self, land, n_spending, s_spending, current_p):
+        s_gain = self.ie.SettlerExpan(s_spending, land)
+        return self.ie.SettlerMI(land + s_gain) * self.ie.SettlerExpanMG(s_spending, land) - 1
+
+    def SettlerFOCDeriv(self, land, n_spending, s_spending, current_p):
+        s_gain = self.ie.SettlerExpan(s_spending, land)
+        mg = self.ie.SettlerExpanMG(s_spending, land)
+        return self.ie.SettlerMIDeriv(land + s_gain) * mg**2 + self.ie.SettlerMI(land + s_gain) * self.ie.SettlerExpanMGDeriv(s_spending, land)
+
     def SettlerResponse(self, land, n_spending, current_p, s_savings):
         if s_savings == None:
             income = self.ie.SettlerIncome(land) 
         else:
             income = self.ie.SettlerIncome(land) + s_savings
         Sfun = lambda s_spending: self.SettlerProfit(land, n_spending, s_spending, current_p)
-        return fminbound(lambda s: -Sfun(s), 0, income)
+        from scipy.optimize import fminbound
+        return fminbound(*self.Objectives(lambda s: -Sfun(s)), 0, income)
+
+    def SettlerResponses(self, land, n_spendings, current_p, s_savings):
+        n_spendings = np.asarray(n_spendings, dtype=float)
+        if self.method == 'fminbound':
+            return np.array([self.SettlerResponse(land, n_spending, current_p, s_savings) for n_spending in n_spendings])
+        if s_savings == None:
+            income = self.ie.SettlerIncome(land)
+        else:
+            income = self.ie.SettlerIncome(land) + s_savings
+        if self.method == 'newton':
+            return SafeguardedNewton(*self.Objectives(lambda s: self.SettlerFOC(land, n_spendings, s, current_p),
+                                                      lambda s: self.SettlerFOCDeriv(land, n_spendings, s, current_p)),
+                                     0, np.full_like(n_spendings, income))
+        Sfun = lambda s_spending: self.SettlerProfit(land, n_spendings, s_spending, current_p)
+        return GoldenSectionSearch(*self.Objectives(lambda s: -Sfun(s)), 0, np.full_like(n_spendings, income))
+
+class EquilibriumCache:
+    '''
+    Bounded LRU memo of DP.PeriodEquilibrium results. The key carries DP.ModelKey, so one cache can be
+    shared by every DP built on identical IncomeExpansion/PlayerDecision parameters. Results are copied in
+    and out, so a caller changing the lists it gets back does not change later hits.
+    
+    Parameters:
+    ----------
+    maxsize (int): maximum number of stored equilibria, the least recently used one is evicted first.
+    decimals (int): land and savings are rounded to this many decimals in the key.
+    '''
+    def __init__(self, maxsize=4096, decimals=6):
+        self.maxsize, self.decimals = maxsize, decimals
+        self.store = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def Key(self, model_key, n_land, current_p, n_savings, s_savings, saving):
+        quantize = lambda value: None if value is None else round(float(value), self.decimals)
+        return (model_key, quantize(n_land), current_p, quantize(n_savings), quantize(s_savings), saving)
+
+    def Get(self, key):
+        if key in self.store:
+            self.store.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(self.store[key])
+        self.misses += 1
+        return None
+
+    def Put(self, key, value):
+        self.store[key] = copy.deepcopy(value)
+        self.store.move_to_end(key)
+        if len(self.store) > self.maxsize:
+            self.store.popitem(last=False)
+            self.evictions += 1
+
+    def Clear(self):
+        self.store.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def Stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.store),
+                'hit_rate': self.hits/lookups if lookups else 0.}
+
+class RandomStream:
+    '''
+    Block-buffered source of the scalar variates drawn once per event in the simulation. Uniforms and standard
+    normals are drawn block values at a time from a seeded numpy Generator and handed out one by one as Python
+    floats, so a draw is a next() instead of a numpy call; draws of more than a few values go to the Generator
+    directly. Provides the part of the np.random API the simulation uses (random, standard_normal, normal,
+    uniform, geometric), so it can stand in for np.random or a Generator, and Choice for sampling from a
+    precomputed CDF. An antithetic stream hands out 1 - u and -z for the uniforms u and normals z of the
+    plain stream with the same seed.
+
+    Parameters:
+    ----------
+    seed: anything numpy.random.default_rng accepts.
+    block (int): number of variates drawn at a time per kind.
+    antithetic (bool): mirror every variate.
+    '''
+    def __init__(self, seed=None, block=8192, antithetic=False):
+        self.rng = np.random.default_rng(seed)
+        self.block = block
+        self.antithetic = antithetic
+        self.buffers = {}
+
+    def Draw(self, kind, size):
+        values = getattr(self.rng, kind)(size)
+        if self.antithetic:
+            return 1 - values if kind == 'random' else -values
+        return values
+
+    def Take(self, kind, size=None):
+        '''
+        Draw size variates of kind ('random' or 'standard_normal'). Scalars and arrays of up to 16 values come
+        from the buffer of kind; larger arrays are drawn from the Generator directly and leave the buffer as it
+        is, so the values a stream hands out depend on the sizes asked for, not only on their total.
+        '''
+        if size is None:
+            buffer = self.buffers.get(kind)
+            value = None if buffer is None else next(buffer, None)
+            if value is None:
+                self.buffers[kind] = iter(self.Draw(kind, self.block).tolist())
+                value = next(self.buffers[kind])
+            return value
+        n = size if isinstance(size, int) else int(np.prod(size))
+        if n <= 16:
+            return np.array([self.Take(kind) for _ in range(n)]).reshape(size)
+        return self.Draw(kind, size)
+
+    def random(self, size=None):
+        return self.Take('random', size)
+
+    def standard_normal(self, size=None):
+        return self.Take('standard_normal', size)
+
+    def normal(self, loc=0., scale=1., size=None):
+        return loc + scale * self.standard_normal(size)
+
+    def uniform(self, low=0., high=1., size=None):
+        return low + (high - low) * self.random(size)
+
+    def geometric(self, p, size=None):
+        if size is None:
+            return max(math.ceil(math.log1p(-self.random())/math.log1p(-p)), 1)
+        trials = np.ceil(np.log1p(-self.random(size))/np.log1p(-p))
+        return np.maximum(trials, 1).astype(int)
+
+    def Choice(self, values, cdf, size=None):
+        '''
+        Draw from values with cumulative probabilities cdf (np.cumsum of the probabilities) by inversion.
+        '''
+        if size is None:
+            return values[min(int(np.searchsorted(cdf, self.random(), side='right')), len(values) - 1)]
+        return values[np.minimum(np.searchsorted(cdf, self.random(size), side='right'), len(values) - 1)]
+
+class Tracer:
+    '''
+    Opt-in instrumentation shared by DP, PlayerDecision/NaivePlayerDecision and TreatySimulation. Objects without
+    a tracer only pay for an `is None` test. Counters accumulate over the tracer's life (optimizer calls, objective
+    evaluations, phase times in seconds, cache hits, treaty events) and Record stores one structured record per
+    period, run or match, holding the counter increments since it started.
+
+    Usage: tracer = Tracer().Attach(dp, dp.pd), then tracer.ToFrame('period') or tracer.WriteJSONLines(path).
+    '''
+    def __init__(self):
+        self.counters, self.records = {}, []
+        self.last = time.perf_counter()
+
+    def Attach(self, *objects):
+        for obj in objects:
+            obj.tracer = self
+        return self
+
+    def Count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def Counted(self, name, fun):
+        '''
+        Wrap fun so that every call adds the number of points it was evaluated on to counter name.
+        '''
+        def wrapper(x):
+            values = fun(x)
+            self.Count(name, np.size(values))
+            return values
+        return wrapper
+
+    def Lap(self, name=None):
+        '''
+        Add the time since the previous lap to counter name, or just restart the lap clock if name is None.
+        '''
+        now = time.perf_counter()
+        if name is not None:
+            self.Count(name, now - self.last)
+        self.last = now
+
+    def Snapshot(self):
+        return dict(self.counters)
+
+    def Since(self, snapshot):
+        return {name: value - snapshot.get(name, 0) for name, value in self.counters.items()}
+
+    def Record(self, event, counters=None, **fields):
+        record = dict(event=event, **fields)
+        record.update(counters or {})
+        self.records.append(record)
+
+    def Clear(self):
+        self.counters, self.records = {}, []
+
+    def ToFrame(self, event=None):
+        import pandas
+        records = [record for record in self.records if event is None or record['event'] == event]
+        return pandas.DataFrame(records)
+
+    def WriteJSONLines(self, path, event=None):
+        native = lambda value: value.item() if hasattr(value, 'item') else str(value)
+        with open(path, 'w') as f:
+            for record in self.records:
+                if event is None or record['event'] == event:
+                    f.write(json.dumps(record, default=native) + '\n')
      
+class TrajectoryRecorder:
+    '''
+    Storage of the path of DynamicNE or Simulation, in preallocated numpy buffers instead of growing lists.
+    record='none' keeps only the last period, 'summary' the spending and land paths, 'full' also every period's
+    spending grids and responses, in one (slots, 4, width) array padded with nan, or of the keep_last last periods
+    only in a ring buffer. Buffers grow by doubling up to their bound, so memory stays flat in long runs.
+
+    Parameters:
+    ----------
+    record (str): 'none', 'summary' or 'full'.
+    max_periods (int): bound of the number of recorded periods.
+    keep_last (int): number of periods whose grids are kept with record='full', all if None.
+    dtype: numpy dtype of the buffers, e.g. np.float32 to halve their size.
+    '''
+    def __init__(self, record='full', max_periods=300, keep_last=None, dtype=np.float64):
+        if record not in ('none', 'summary', 'full'):
+            raise ValueError("record must be 'none', 'summary' or 'full'!")
+        self.record, self.max_periods, self.dtype = record, max_periods, dtype
+        self.slots = max_periods if keep_last is None else min(keep_last, max_periods)
+        self.n = 0
+        rows = 1 if record == 'none' else min(max_periods, 64)
+        self.spending, self.land = np.empty((rows, 2), dtype), np.empty(rows, dtype)
+        self.grids, self.lengths = None, None
+
+    def Grow(self, buffer, bound):
+        grown = np.empty((min(2*len(buffer), bound),) + buffer.shape[1:], buffer.dtype)
+        grown[:len(buffer)] = buffer
+        if grown.dtype.kind == 'f':
+            grown[len(buffer):] = np.nan
+        return grown
+
+    def Add(self, n_land, eq_spending, spendings, responses):
+        i = 0 if self.record == 'none' else self.n
+        if i >= len(self.land):
+            self.spending, self.land = self.Grow(self.spending, self.max_periods), self.Grow(self.land, self.max_periods)
+        self.spending[i], self.land[i] = eq_spending, n_land
+        if self.record == 'full':
+            self.AddGrids(list(spendings) + list(responses[::-1]) if len(responses) else list(spendings) + [[], []])
+        self.n += 1
+
+    def AddGrids(self, arrays):
+        width = max(len(array) for array in arrays)
+        if self.grids is None:
+            self.grids = np.full((min(self.slots, 64), 4, width), np.nan, self.dtype)
+            self.lengths = np.zeros((len(self.grids), 4), dtype=np.int64)
+        if width > self.grids.shape[2]:
+            widened = np.full(self.grids.shape[:2] + (width,), np.nan, self.dtype)
+            widened[:, :, :self.grids.shape[2]] = self.grids
+            self.grids = widened
+        slot = self.n % self.slots
+        if slot >= len(self.grids):
+            self.grids, self.lengths = self.Grow(self.grids, self.slots), self.Grow(self.lengths, self.slots)
+        self.grids[slot] = np.nan
+        for j, array in enumerate(arrays): # n_spendings, s_spendings, n_responses, s_responses
+            self.grids[slot, j, :len(array)] = array
+            self.lengths[slot, j] = len(array)
+
+    def Spending(self):
+        return self.spending[:min(self.n, len(self.spending))]
+
+    def Land(self):
+        return self.land[:min(self.n, len(self.land))]
+
+    def Grids(self):
+        '''
+        The recorded periods as DynamicNE's spe_res, [[n_spendings, s_spendings], [s_responses, n_responses]] per
+        period in order (the last keep_last ones), as views of the buffer. None unless record is 'full'.
+        '''
+        if self.record != 'full':
+            return None
+        periods = range(max(self.n - self.slots, 0), self.n)
+        rows = [(self.grids[i % self.slots], self.lengths[i % self.slots]) for i in periods]
+        return [[[grid[0, :length[0]], grid[1, :length[1]]], [grid[3, :length[3]], grid[2, :length[2]]] if length[2] else []]
+                for grid, length in rows]
+
 class DP:
     '''
     Dynamic programming figuring out the best response of each player.
@@ -190,25 +713,85 @@ class DP:
     ----------
     IE: IncomeExpansion instance:
     PD: PlayerDecision instance.
+    ne_method: how each period's equilibrium is found. 'grid' scans the response grid (FindNE),
+               'exact' solves the fixed point of the interpolated response curves (FindExactNE) and
+               'direct' solves it on the best responses themselves without building a grid (SolveNE).
+    grids (int): number of grid points in ResponseList, doubled when saving is allowed.
+    refine_tol (float): if given, ResponseList uses AdaptiveResponseList with this tolerance instead of
+               the uniform grid of grids points.
+    cache: optional EquilibriumCache memoizing PeriodEquilibrium.
+    tracer: optional Tracer timing the best-response, NE-search and land-update phases of every period.
     '''
-    def __init__(self, IE, PD):
+    def __init__(self, IE, PD, ne_method='grid', grids=250, cache=None, tracer=None, refine_tol=None):
+         if ne_method not in NE_METHODS:
+             raise ValueError('Unknown equilibrium method: {}'.format(ne_method))
          self.ie, self.pd = IE, PD
+         self.ne_method = ne_method
+         self.grids = grids
+         self.cache = cache
+         self.tracer = tracer
+         self.refine_tol = refine_tol
+         self.last_recorder = None
+
+    def ModelKey(self):
+         return (type(self.pd).__name__, self.ie.Params(), self.pd.periods, self.pd.n_dft, self.pd.method, self.ne_method, self.grids,
+                 self.refine_tol)
     def ResponseList(self, n_land, current_p, n_savings=None, s_savings=None, saving=False):
+         if self.refine_tol is not None:
+             spendings, responses, evaluations = self.AdaptiveResponseList(n_land, current_p, n_savings, s_savings, saving,
+                                                                           self.refine_tol)
+             if self.tracer is not None:
+                 self.tracer.Count('response_points', evaluations)
+             return spendings, responses
          n_income = self.ie.NativeIncome(n_land)
          s_income = self.ie.SettlerIncome(100 - n_land)
          if not saving:
-             n_spending_list = np.linspace(0, n_income, 250)
-             s_spending_list = np.linspace(0, s_income, 250)
+             n_spending_list = np.linspace(0, n_income, self.grids)
+             s_spending_list = np.linspace(0, s_income, self.grids)
          else:
-             n_spending_list = np.linspace(0, n_income+n_savings, 500)
-             s_spending_list = np.linspace(0, s_income+s_savings, 500)
-         n_best_spending = []
-         s_best_spending = []
-         for s_spending in s_spending_list:
-             n_best_spending.append(self.pd.NativeResponse(n_land, s_spending, current_p, n_savings))
-         for n_spending in n_spending_list:
-             s_best_spending.append(self.pd.SettlerResponse(100 - n_land, n_spending, current_p, s_savings))
+             n_spending_list = np.linspace(0, n_income+n_savings, 2*self.grids)
+             s_spending_list = np.linspace(0, s_income+s_savings, 2*self.grids)
+         n_best_spending = self.pd.NativeResponses(n_land, s_spending_list, current_p, n_savings)
+         s_best_spending = self.pd.SettlerResponses(100 - n_land, n_spending_list, current_p, s_savings)
+         if self.tracer is not None:
+             self.tracer.Count('response_points', len(n_spending_list) + len(s_spending_list))
          return [n_spending_list, s_spending_list], [s_best_spending, n_best_spending]
+
+    def AdaptiveResponseList(self, n_land, current_p, n_savings=None, s_savings=None, saving=False, tol=1e-3,
+                             coarse=9, refine=3, max_rounds=100):
+         '''
+         ResponseList on a coarse-to-fine grid. Best responses are computed on coarse points per player, then only
+         the grid cells around the first crossing of the interpolated response curves (the equilibrium FindExactNE
+         finds) get refine new points per round, until both cells are narrower than tol.
+         Return spendings and responses as ResponseList (on sorted, non-uniform grids) and the number of
+         best responses evaluated.
+         '''
+         n_income = self.ie.NativeIncome(n_land)
+         s_income = self.ie.SettlerIncome(100 - n_land)
+         if saving:
+             n_income, s_income = n_income + n_savings, s_income + s_savings
+         n_list, s_list = np.linspace(0, n_income, coarse), np.linspace(0, s_income, coarse)
+         s_best = self.pd.SettlerResponses(100 - n_land, n_list, current_p, s_savings)
+         n_best = self.pd.NativeResponses(n_land, s_list, current_p, n_savings)
+         for _ in range(max_rounds):
+             gaps = np.interp(s_best, s_list, n_best) - n_list
+             crossing = np.nonzero(gaps[:-1] * gaps[1:] <= 0)[0]
+             if len(crossing) == 0:
+                 break
+             i = crossing[0]
+             n_lo, n_hi = n_list[i], n_list[i+1]
+             j_lo = max(np.searchsorted(s_list, min(s_best[i], s_best[i+1]), side='right') - 1, 0)
+             j_hi = min(np.searchsorted(s_list, max(s_best[i], s_best[i+1])), len(s_list) - 1)
+             s_lo, s_hi = s_list[j_lo], s_list[max(j_hi, j_lo)]
+             if n_hi - n_lo <= tol and s_hi - s_lo <= tol:
+                 break
+             if n_hi - n_lo > tol:
+                 new_n = np.linspace(n_lo, n_hi, refine + 2)[1:-1]
+                 n_list, s_best = MergeGrid(n_list, s_best, new_n, self.pd.SettlerResponses(100 - n_land, new_n, current_p, s_savings))
+             if s_hi - s_lo > tol:
+                 new_s = np.linspace(s_lo, s_hi, refine + 2)[1:-1]
+                 s_list, n_best = MergeGrid(s_list, n_best, new_s, self.pd.NativeResponses(n_land, new_s, current_p, n_savings))
+         return [n_list, s_list], [s_best, n_best], len(n_list) + len(s_list)
      
     def FindNE(self, income_list, spending_list): #[n_spending_list, s_spending_list], [s_best_spending, n_best_spending]
          for s_spending in spending_list[0]:
@@ -219,6 +802,169 @@ class DP:
                  return [n_spending, s_spending] 
              else:
                  pass
+
+    def FindNEResidual(self, income_list, spending_list, eq_spending):
+         '''
+         Residual of a FindNE equilibrium: the distance FindNE tests against 0.01, nan if there is none.
+         '''
+         if eq_spending is None:
+             return np.nan
+         n_index = (np.abs(np.array(income_list[0]) - eq_spending[0])).argmin()
+         return abs(spending_list[0][n_index] - eq_spending[1])
+
+    def FixedPoint(self, gap, n_points, xtol=1e-10):
+         '''
+         Find the lowest root of gap (native's best response to settler's best response, minus native spending)
+         on the increasing array n_points. Return [n_spending, residual, converged].
+         '''
+         gaps = gap(n_points)
+         crossing = np.nonzero(gaps[:-1] * gaps[1:] <= 0)[0]
+         if len(crossing) == 0:
+             i = np.nanargmin(np.abs(gaps))
+             return [n_points[i], abs(gaps[i]), False]
+         i = crossing[0]
+         if gaps[i] == 0:
+             return [n_points[i], 0., True]
+         from scipy.optimize import brentq
+         n_spending, r = brentq(lambda n: gap(np.array([n]))[0], n_points[i], n_points[i+1], xtol=xtol, full_output=True)
+         return [n_spending, abs(gap(np.array([n_spending]))[0]), r.converged]
+
+    def FindExactNE(self, income_list, spending_list, xtol=1e-10): #[n_spending_list, s_spending_list], [s_best_spending, n_best_spending]
+         '''
+         Take the output of ResponseList. Return the equilibrium spending [n_spending, s_spending], the residual
+         |R_n(R_s(n)) - n| and whether the root search converged. Both best responses are linearly interpolated
+         between grid points, so the equilibrium is not restricted to the grid and is never None.
+         '''
+         n_list, s_list = np.asarray(income_list[0]), np.asarray(income_list[1])
+         s_best, n_best = np.asarray(spending_list[0]), np.asarray(spending_list[1])
+         s_response = lambda n: np.interp(n, n_list, s_best)
+         gap = lambda n: np.interp(s_response(n), s_list, n_best) - n
+         n_spending, residual, converged = self.FixedPoint(gap, n_list, xtol)
+         return [n_spending, float(s_response(n_spending))], residual, converged
+
+    def SolveNE(self, n_land, current_p, n_savings=None, s_savings=None, saving=False, xtol=1e-8):
+         '''
+         Same as FindExactNE, but bracket and solve the fixed point on the players' best responses directly
+         instead of on a ResponseList grid. Return [n_income, s_income] (upper spending bounds),
+         [n_spending, s_spending], residual and convergence flag.
+         '''
+         n_income = self.ie.NativeIncome(n_land)
+         s_income = self.ie.SettlerIncome(100 - n_land)
+         if saving:
+             n_income, s_income = n_income + n_savings, s_income + s_savings
+         s_response = lambda n: self.pd.SettlerResponses(100 - n_land, n, current_p, s_savings)
+         gap = lambda n: self.pd.NativeResponses(n_land, s_response(n), current_p, n_savings) - n
+         n_spending, residual, converged = self.FixedPoint(gap, np.array([0, n_income]), xtol)
+         return [n_income, s_income], [n_spending, s_response(np.array([n_spending]))[0]], residual, converged
+
+    def PeriodEquilibrium(self, n_land, current_p, n_savings=None, s_savings=None, saving=False):
+         '''
+         One period of the game solved with self.ne_method, looked up in self.cache first if there is one.
+         Return spendings, responses (as ResponseList; for 'direct' only the spending bounds and no responses),
+         the equilibrium [n_spending, s_spending] and [residual, converged].
+         '''
+         if self.cache is None:
+             return self.ComputeEquilibrium(n_land, current_p, n_savings, s_savings, saving)
+         key = self.cache.Key(self.ModelKey(), n_land, current_p, n_savings, s_savings, saving)
+         res = self.cache.Get(key)
+         if res is None:
+             res = self.ComputeEquilibrium(n_land, current_p, n_savings, s_savings, saving)
+             self.cache.Put(key, res)
+         elif self.tracer is not None:
+             self.tracer.Count('cache_hits')
+         return res
+
+    def TrackEquilibrium(self, n_land, current_p, n_savings=None, s_savings=None, saving=False, track=None,
+                         land_threshold=5., xtol=1e-8):
+         '''
+         Incremental PeriodEquilibrium for consecutive periods. track is a dict carried between calls ({} at the
+         start) holding the previous land, equilibrium and bracket width. If CanTrack, a period is looked up in
+         self.cache and otherwise solved by TrackedEquilibrium around the previous native spending (the result is
+         cached as PeriodEquilibrium's would be). The period is solved with PeriodEquilibrium when tracking is not
+         possible, there is no previous equilibrium, the land moved more than land_threshold or the local search
+         fails. Return as PeriodEquilibrium.
+         '''
+         res = None
+         if self.CanTrack() and track and track['eq'] is not None and abs(n_land - track['n_land']) <= land_threshold:
+             n_previous = track['eq'][0]
+             key = None if self.cache is None else self.cache.Key(self.ModelKey(), n_land, current_p, n_savings, s_savings, saving)
+             res = None if key is None else self.cache.Get(key)
+             if res is None:
+                 res = self.TrackedEquilibrium(n_land, current_p, n_savings, s_savings, saving, n_previous, track['width'], xtol)
+                 if res is not None and key is not None:
+                     self.cache.Put(key, res)
+             elif self.tracer is not None:
+                 self.tracer.Count('cache_hits')
+         if res is not None:
+             track.update(n_land=n_land, eq=res[2], width=max(2*abs(res[2][0] - n_previous), xtol))
+             if self.tracer is not None:
+                 self.tracer.Count('tracked_periods')
+             return res
+         res = self.PeriodEquilibrium(n_land, current_p, n_savings, s_savings, saving)
+         track.update(n_land=n_land, eq=res[2], width=1e-3)
+         if self.tracer is not None:
+             self.tracer.Count('full_solves')
+         return res
+
+    def CanTrack(self):
+         '''
+         Whether TrackEquilibrium may solve periods with TrackedEquilibrium: only with ne_method='direct', whose
+         fixed point the local search finds too, and only if ComputeEquilibrium is DP's own, so that subclasses
+         solving periods differently (BackwardDP, SurfaceDP) are never bypassed. A subclass overriding
+         ComputeEquilibrium may override TrackedEquilibrium and this to track its own equilibria.
+         '''
+         return self.ne_method == 'direct' and type(self).ComputeEquilibrium is DP.ComputeEquilibrium
+
+    def TrackedEquilibrium(self, n_land, current_p, n_savings, s_savings, saving, n_previous, width, xtol=1e-8):
+         '''
+         ComputeEquilibrium with ne_method='direct', but with the fixed point searched in a bracket around
+         n_previous, width wide on either side and widened fourfold while it holds no root, so that a period
+         costs a few best responses when the state barely changes. Return as ComputeEquilibrium, None if no
+         root is found.
+         '''
+         tracer = self.tracer
+         if tracer is not None:
+             tracer.Lap()
+         n_income = self.ie.NativeIncome(n_land)
+         s_income = self.ie.SettlerIncome(100 - n_land)
+         if saving:
+             n_income, s_income = n_income + n_savings, s_income + s_savings
+         s_response = lambda n: self.pd.SettlerResponses(100 - n_land, n, current_p, s_savings)
+         gap = lambda n: self.pd.NativeResponses(n_land, s_response(n), current_p, n_savings) - n
+         res = None
+         for _ in range(8):
+             bracket = np.array([max(n_previous - width, 0), min(n_previous + width, n_income)])
+             n_spending, residual, converged = self.FixedPoint(gap, bracket, xtol)
+             if converged:
+                 eq_spending = [n_spending, s_response(np.array([n_spending]))[0]]
+                 res = [np.array([0, n_income]), np.array([0, s_income])], [], eq_spending, [residual, converged]
+                 break
+             width *= 4
+         if tracer is not None:
+             tracer.Lap('ne_time')
+         return res
+
+    def ComputeEquilibrium(self, n_land, current_p, n_savings=None, s_savings=None, saving=False):
+         tracer = self.tracer
+         if tracer is not None:
+             tracer.Lap()
+         if self.ne_method == 'direct': # best responses and NE search are one phase here
+             bounds, eq_spending, residual, converged = self.SolveNE(n_land, current_p, n_savings, s_savings, saving)
+             spendings = [np.array([0, bounds[0]]), np.array([0, bounds[1]])]
+             if tracer is not None:
+                 tracer.Lap('ne_time')
+             return spendings, [], eq_spending, [residual, converged]
+         spendings, responses = self.ResponseList(n_land, current_p, n_savings, s_savings, saving)
+         if tracer is not None:
+             tracer.Lap('response_time')
+         if self.ne_method == 'exact':
+             eq_spending, residual, converged = self.FindExactNE(spendings, responses)
+         else:
+             eq_spending = self.FindNE(spendings, responses)
+             residual, converged = self.FindNEResidual(spendings, responses, eq_spending), eq_spending is not None
+         if tracer is not None:
+             tracer.Lap('ne_time')
+         return spendings, responses, eq_spending, [residual, converged]
      
     def IfEqSpending(self, n_land, eq_spending, tol=1e-4, simulation=False): # [n_spending, s_spending] 
          diff = self.ie.NativeExpan(eq_spending[0], n_land) - self.ie.SettlerExpan(eq_spending[1], 100 - n_land)
@@ -227,32 +973,55 @@ class DP:
          else:
              return diff
      
-    def DynamicNE(self, n_land, saving=False, max_iter=300, verbose=True): #[n_income_list, s_income_list], [s_best_spending, n_best_spending]
+    def DynamicNE(self, n_land, saving=False, max_iter=300, verbose=True, incremental=False, land_threshold=5.,
+                  record='full', keep_last=None, dtype=np.float64): #[n_income_list, s_income_list], [s_best_spending, n_best_spending]
          '''
          Take the intial land of Native. Return native and settler's best spending, native's land  and spe_res.
          
          Parameters:
          ----------
              n_land (float): Native's land.
+             incremental (bool): track each period's equilibrium from the previous one (TrackEquilibrium; see CanTrack).
+             land_threshold (float): land move above which an incremental run fully re-solves the period.
+             record (str): 'full' for every period's grids in spe_res, 'summary' for the spending and land paths only
+                 (spe_res is None), 'none' for the last period only. See TrajectoryRecorder.
+             keep_last (int): with record='full', keep the grids of the last keep_last periods only.
+             dtype: numpy dtype of the recorded arrays.
          '''
-         spe_res, ns_best_spending, n_land_list = [], [], []
+         recorder = TrajectoryRecorder(record, max_iter, keep_last, dtype)
          n, diff = 1, 0
          n_savings = s_savings = 0
+         track = {}
+         tracer = self.tracer
+         if tracer is not None:
+             run_start, run_time = tracer.Snapshot(), time.perf_counter()
          while n < max_iter and diff != 'pass':
              n_land += diff
-             n_land_list.append(n_land) 
-             spendings, responses = self.ResponseList(n_land, n, n_savings, s_savings, saving)
-             eq_spending = self.FindNE(spendings, responses)
+             if tracer is not None:
+                 period_start = tracer.Snapshot()
+             if incremental:
+                 spendings, responses, eq_spending, status = self.TrackEquilibrium(n_land, n, n_savings, s_savings, saving,
+                                                                                   track, land_threshold)
+             else:
+                 spendings, responses, eq_spending, status = self.PeriodEquilibrium(n_land, n, n_savings, s_savings, saving)
+             recorder.Add(n_land, eq_spending, spendings, responses)
              if not saving:
                  n_savings += spendings[0][-1] - eq_spending[0]
                  s_savings += spendings[1][-1] - eq_spending[1] 
              else:
                  n_savings = spendings[0][-1] - eq_spending[0]
                  s_savings = spendings[1][-1] - eq_spending[1] 
+             if tracer is not None:
+                 tracer.Lap()
              diff = self.IfEqSpending(n_land, eq_spending)
-             ns_best_spending.append(eq_spending)
-             spe_res.append([spendings, responses])
+             if tracer is not None:
+                 tracer.Lap('land_time')
+                 tracer.Record('period', tracer.Since(period_start), source='DynamicNE', period=n, n_land=n_land,
+                               residual=status[0], converged=status[1])
              n += 1
+         if tracer is not None:
+             tracer.Record('run', tracer.Since(run_start), source='DynamicNE', periods=n - 1, converged=diff == 'pass',
+                           time=time.perf_counter() - run_time)
          if diff == 'pass' and verbose==True:
              print('Convergence succeeded in iteration: {}'.format(n))
              print('Land in Nash equilibrium for native and settler are: {:.2f} and {:.2f}'.format(n_land, 100-n_land))
@@ -260,7 +1029,7 @@ class DP:
              print(f'Native saving = {n_savings:.2f}, Settler saving = {s_savings:.2f}')
          elif n == max_iter and verbose==True:
              print('Convergence failed!')
-         return np.array(ns_best_spending), np.array(n_land_list), spe_res
+         return recorder.Spending(), recorder.Land(), recorder.Grids()
      
     def PeriodResults(self, ns_spending, n_land, t=20):
          n_income = self.ie.NativeIncome(n_land)
@@ -274,6 +1043,7 @@ class DP:
              print(title)
              print(np.around(value[:t], 2)) if len(value) > t else print(np.around(value, 2))
              print()
+         import matplotlib.pyplot as plt
          _, (axes) = plt.subplots(1, 3, sharex = True, figsize = (14, 12))
          titles2 = ['Period spending', 'Period consumption', 'Cumulative consumptions']
          n_values = [n_best_spending, n_cons, np.cumsum(n_cons)]
@@ -286,9 +1056,10 @@ class DP:
              ax.grid()
          plt.show()
     
-    def SpendingShocks(self, n_savings, n_spendings, s_savings, s_spendings, shock_size):
+    def SpendingShocks(self, n_savings, n_spendings, s_savings, s_spendings, shock_size, rng=None):
         mu, sd = shock_size
-        n_shock, s_shock = mu + sd*np.random.randn(2)
+        normals = np.random.randn(2) if rng is None else rng.standard_normal(2)
+        n_shock, s_shock = mu + sd*normals
         n_final_spendings = n_spendings + n_shock
         s_final_spendings = s_spendings + s_shock
         if n_final_spendings > n_savings or n_final_spendings < 0:
@@ -297,9 +1068,11 @@ class DP:
             s_final_spendings = s_spendings
         return n_final_spendings, s_final_spendings
          
-    def Simulation(self, n_land, un_periods, saving=True, shock=True, shock_size=(0, 2)): #[n_income_list, s_income_list], [s_best_spending, n_best_spending]
+    def Simulation(self, n_land, un_periods, saving=True, shock=True, shock_size=(0, 2), rng=None,
+                   incremental=False, land_threshold=5., record='none', keep_last=None, dtype=np.float64): #[n_income_list, s_income_list], [s_best_spending, n_best_spending]
          '''
          Take the intial land of Native and uncertainty periods. Return total periods, native and settler's final profit.
+         If record is not 'none', the TrajectoryRecorder of the run is left in self.last_recorder.
          
          Parameters:
          ----------
@@ -308,24 +1081,50 @@ class DP:
              saving (bool): whether allow players saving.
              shock (bool): whether add shock to each period.
              shock_size (array-like[float,float]): support normal shock. The first param is mean and the second is sd.
+             rng (numpy.random.Generator or RandomStream): stream for the shocks, the global np.random state if None.
+             incremental (bool): track each period's equilibrium from the previous one (TrackEquilibrium; see CanTrack).
+             land_threshold (float): land move above which an incremental run fully re-solves the period.
+             record (str), keep_last (int), dtype: path recording, as in DynamicNE; spendings are recorded after the shocks.
          '''
          tot_periods = self.pd.n_dft + un_periods
+         recorder = None if record == 'none' else TrajectoryRecorder(record, tot_periods, keep_last, dtype)
+         self.last_recorder = recorder
          n, diff = 1, 0
          n_savings = s_savings = 0
+         track = {}
+         tracer = self.tracer
+         if tracer is not None:
+             run_start, run_time = tracer.Snapshot(), time.perf_counter()
          while n <= tot_periods:
              n_land += diff
-             spendings, responses = self.ResponseList(n_land, n, n_savings, s_savings, saving)
-             eq_spending = self.FindNE(spendings, responses)
+             if tracer is not None:
+                 period_start = tracer.Snapshot()
+             if incremental:
+                 spendings, responses, eq_spending, status = self.TrackEquilibrium(n_land, n, n_savings, s_savings, saving,
+                                                                                   track, land_threshold)
+             else:
+                 spendings, responses, eq_spending, status = self.PeriodEquilibrium(n_land, n, n_savings, s_savings, saving)
              if shock:
-                 eq_spending = self.SpendingShocks(spendings[0][-1], eq_spending[0], spendings[1][-1], eq_spending[1], shock_size)
+                 eq_spending = self.SpendingShocks(spendings[0][-1], eq_spending[0], spendings[1][-1], eq_spending[1], shock_size, rng)
+             if recorder is not None:
+                 recorder.Add(n_land, eq_spending, spendings, responses)
              if not saving:
                  n_savings += spendings[0][-1] - eq_spending[0]
                  s_savings += spendings[1][-1] - eq_spending[1] 
              else:
                  n_savings = spendings[0][-1] - eq_spending[0]
                  s_savings = spendings[1][-1] - eq_spending[1] 
+             if tracer is not None:
+                 tracer.Lap()
              diff = self.IfEqSpending(n_land, eq_spending, simulation=True)
+             if tracer is not None:
+                 tracer.Lap('land_time')
+                 tracer.Record('period', tracer.Since(period_start), source='Simulation', period=n, n_land=n_land,
+                               residual=status[0], converged=status[1])
              n += 1
+         if tracer is not None:
+             tracer.Record('run', tracer.Since(run_start), source='Simulation', periods=tot_periods,
+                           time=time.perf_counter() - run_time)
          return tot_periods, round(n_savings, 2), round(s_savings, 2)
     
 
@@ -0,0 +1,132 @@
+### Precomputed equilibrium policy surface for the treaty game ###
+
+import os
+import json
+import hashlib
+import numpy as np
+from Treaty_game_model import DP
+
+SURFACE_VERSION = 1
+FIELDS = ['NativeSpending', 'SettlerSpending', 'NativeLandChange', 'NativeBound', 'SettlerBound']
+
+def SurfaceKey(dp, saving=False):
+    return hashlib.sha1(repr((SURFACE_VERSION, dp.ModelKey(), saving)).encode()).hexdigest()[:16]
+
+def BuildPolicySurface(dp, directory, lands=np.linspace(1, 99, 197), periods=None, savings=None, saving=False):
+    '''
+    Solve dp.PeriodEquilibrium on every node of a (native land x period [x native savings x settler savings]) grid
+    and store the FIELDS of each node in <directory>/policy_<key>/surface.npy, next to a meta.json holding the
+    format version, the parameter key and the grid axes. Return the path of the surface. Raise a ValueError
+    listing the nodes without an equilibrium (possible with ne_method='grid') instead of storing them.
+
+    Parameters:
+    ----------
+        dp: DP instance, preferably with ne_method='exact' or 'direct' so that every node has an equilibrium.
+        directory (str): where the surface directory is created.
+        lands (array-like): native land axis.
+        periods (array-like[int]): period axis, 1 to n_default+1 by default. Later periods share the last node.
+        savings (array-like): savings axis, used for both players when saving=True.
+        saving (bool): whether players are allowed to spend savings.
+    '''
+    if periods is None:
+        periods = np.arange(1, dp.pd.n_dft + 2)
+    axes = [np.asarray(lands, dtype=float), np.asarray(periods, dtype=float)]
+    if saving:
+        if savings is None:
+            raise ValueError('A savings axis is required when saving=True!')
+        axes += [np.asarray(savings, dtype=float)] * 2
+    surface = np.empty([len(axis) for axis in axes] + [len(FIELDS)])
+    failed = []
+    for index in np.ndindex(*surface.shape[:-1]):
+        n_land, current_p = axes[0][index[0]], int(axes[1][index[1]])
+        n_savings, s_savings = (axes[2][index[2]], axes[3][index[3]]) if saving else (None, None)
+        spendings, _, eq_spending, _ = dp.PeriodEquilibrium(n_land, current_p, n_savings, s_savings, saving)
+        if eq_spending is None:
+            failed.append((n_land, current_p, n_savings, s_savings) if saving else (n_land, current_p))
+            continue
+        land_diff = dp.IfEqSpending(n_land, eq_spending, simulation=True)
+        surface[index] = [eq_spending[0], eq_spending[1], land_diff, spendings[0][-1], spendings[1][-1]]
+    if failed:
+        raise ValueError('No equilibrium at {} of {} nodes, e.g. (land, period{}) {}; use ne_method="exact" or "direct"!'.format(
+            len(failed), int(np.prod(surface.shape[:-1])), ', savings' if saving else '', failed[:5]))
+    path = os.path.join(directory, 'policy_' + SurfaceKey(dp, saving))
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'surface.tmp.npy'), surface)
+    os.replace(os.path.join(path, 'surface.tmp.npy'), os.path.join(path, 'surface.npy'))
+    meta = {'version': SURFACE_VERSION, 'key': SurfaceKey(dp, saving), 'model': repr(dp.ModelKey()),
+            'saving': saving, 'fields': FIELDS, 'axes': [axis.tolist() for axis in axes]}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return path
+
+def MultilinearInterpolate(axes, values, point):
+    '''
+    Interpolate values (grid shape + trailing field axis) at point, clamped to the grid. Only the 2^d
+    surrounding nodes are read, so values can stay memory-mapped.
+    '''
+    corners, weights = [], []
+    for axis, x in zip(axes, point):
+        x = min(max(x, axis[0]), axis[-1])
+        if len(axis) == 1:
+            corners.append(slice(0, 1))
+            weights.append(0.)
+            continue
+        i = min(np.searchsorted(axis, x, side='right') - 1, len(axis) - 2)
+        corners.append(slice(i, i + 2))
+        weights.append((x - axis[i])/(axis[i+1] - axis[i]))
+    block = np.asarray(values[tuple(corners)])
+    for w in weights:
+        block = block[0] if block.shape[0] == 1 else block[0] * (1 - w) + block[1] * w
+    return block
+
+class PolicySurface:
+    '''
+    Read-only, memory-mapped policy surface written by BuildPolicySurface. Processes opening the same
+    path share one copy of it through the page cache.
+
+    Parameters:
+    ----------
+    path (str): surface directory.
+    dp: optional DP instance; if given, the surface must have been built on the same parameters.
+    '''
+    def __init__(self, path, dp=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != SURFACE_VERSION:
+            raise ValueError('Policy surface version {} is not supported!'.format(meta['version']))
+        if dp is not None and meta['key'] != SurfaceKey(dp, meta['saving']):
+            raise ValueError('Policy surface was built for other model parameters!')
+        self.key, self.saving = meta['key'], meta['saving']
+        self.axes = [np.array(axis) for axis in meta['axes']]
+        self.values = np.load(os.path.join(path, 'surface.npy'), mmap_mode='r')
+
+    def Query(self, n_land, current_p, n_savings=None, s_savings=None):
+        '''
+        Return the interpolated FIELDS at the given state.
+        '''
+        point = [n_land, current_p] + ([n_savings, s_savings] if self.saving else [])
+        return MultilinearInterpolate(self.axes, self.values, point)
+
+class SurfaceDP(DP):
+    '''
+    DP whose period equilibria are looked up in a PolicySurface instead of being solved, so that
+    DynamicNE, Simulation and TreatySimulation become table lookups.
+
+    Parameters:
+    ----------
+    IE: IncomeExpansion instance.
+    PD: PlayerDecision instance.
+    surface: PolicySurface built on the same IE, PD and DP options.
+    Other keyword arguments are passed to DP.
+    '''
+    def __init__(self, IE, PD, surface, **kwargs):
+        super().__init__(IE, PD, **kwargs)
+        if surface.key != SurfaceKey(self, surface.saving):
+            raise ValueError('Policy surface was built for other model parameters!')
+        self.surface = surface
+
+    def ComputeEquilibrium(self, n_land, current_p, n_savings=None, s_savings=None, saving=False):
+        if saving != self.surface.saving:
+            raise ValueError('Policy surface was built with saving={}!'.format(self.surface.saving))
+        n_spending, s_spending, _, n_bound, s_bound = self.surface.Query(n_land, current_p, n_savings, s_savings)
+        return [np.array([0, n_bound]), np.array([0, s_bound])], [], [n_spending, s_spending], [np.nan, True]
@@ -0,0 +1,43 @@
+### Parallel Monte Carlo runs of DP.Simulation ###
+
+import numpy as np
+import pandas
+from concurrent.futures import ProcessPoolExecutor
+
+PROFIT_COLUMNS = ['TotalPeriods', 'NativeProfit', 'SettlerProfit']
+
+def SimulationTask(task):
+    dp, n_land, un_periods, seed, kwargs = task
+    return dp.Simulation(n_land, un_periods, rng=np.random.default_rng(seed), **kwargs)
+
+def RunSimulations(dp, n_land, n=200, un_periods=None, seed=None, workers=1, chunksize=None, **kwargs):
+    '''
+    Run dp.Simulation n times across a process pool. Every run gets its own numpy Generator spawned from
+    one SeedSequence, so the table is identical whatever the number of workers.
+    Return a DataFrame with columns TotalPeriods, NativeProfit, SettlerProfit.
+
+    Parameters:
+    ----------
+        dp: DP instance, pickled to every worker.
+        n_land (float): Native's initial land.
+        n (int): number of runs, ignored if un_periods is given.
+        un_periods (array-like[int]): uncertainty periods of each run. Drawn from a geometric
+            distribution with dp.pd.prob if None, as in the profits study.
+        seed: anything numpy.random.SeedSequence accepts.
+        workers (int): number of processes, runs in this process if 1.
+        chunksize (int): runs sent to a worker at a time, about four chunks per worker by default.
+        kwargs: passed to dp.Simulation (saving, shock, shock_size).
+    '''
+    seed_seq = np.random.SeedSequence(seed)
+    periods_seed, runs_seed = seed_seq.spawn(2)
+    if un_periods is None:
+        un_periods = np.random.default_rng(periods_seed).geometric(dp.pd.prob, size=n)
+    tasks = [(dp, n_land, int(p), s, kwargs) for p, s in zip(un_periods, runs_seed.spawn(len(un_periods)))]
+    if workers == 1:
+        results = list(map(SimulationTask, tasks))
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(tasks)//(4*workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(SimulationTask, tasks, chunksize=chunksize))
+    return pandas.DataFrame(results, columns=PROFIT_COLUMNS)
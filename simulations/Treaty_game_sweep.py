@@ -0,0 +1,173 @@
+### Batched sweeps of the steady-state system ComFuns over model parameters ###
+
+import numpy as np
+import pandas
+from scipy.spatial import cKDTree
+from Treaty_game_equations_solver import IncomeExpansion, X_START, X_BOUNDS
+
+PARAM_NAMES = ['A1', 'B1', 'C1', 'A2', 'B2', 'C2', 'D', 'E', 'H', 'gamma', 'beta', 'prob']
+SENSITIVITY_NAMES = PARAM_NAMES + ['alpha'] # alpha moves gamma and beta together, as in find_eq
+VARIABLES = ['Land', 'NativeSpending', 'SettlerSpending']
+BASE_PARAMS = dict(A1=120, B1=0.045, C1=18, A2=180, B2=0.065, C2=40, D=5, E=20, H=120, gamma=0.4, beta=0.4, prob=1/6)
+
+def ParamValues(params):
+    '''
+    Broadcast arrays of the PARAM_NAMES values of params, one element per point. params maps PARAM_NAMES
+    (or 'alpha' for gamma = beta, as in find_eq) to arrays; missing names are taken from BASE_PARAMS.
+    '''
+    params = dict(params)
+    if 'alpha' in params:
+        params['gamma'] = params['beta'] = params.pop('alpha')
+    return np.broadcast_arrays(*[np.asarray(params.get(name, BASE_PARAMS[name]), dtype=float) for name in PARAM_NAMES])
+
+def ModelBatch(params):
+    '''
+    One IncomeExpansion whose parameters are arrays, one element per point (see ParamValues).
+    '''
+    return IncomeExpansion(*ParamValues(params))
+
+def Subset(params, mask):
+    return {name: np.asarray(values)[mask] if np.ndim(values) else values for name, values in params.items()}
+
+def SolveBatch(ie, x0, tol=1e-10, max_iter=50):
+    '''
+    Damped Newton on ie.ComFuns for every point of a batched IncomeExpansion at once, projected on X_BOUNDS.
+    x0 has shape (3, n). Return the solutions (3, n), the max-norm residuals and the convergence mask.
+    '''
+    lower = np.array(X_BOUNDS[0], dtype=float)[:, None]
+    upper = np.array(X_BOUNDS[1], dtype=float)[:, None]
+    x = np.clip(np.array(x0, dtype=float), lower, upper)
+    with np.errstate(all='ignore'):
+        f = ie.ComFuns(x)
+        norm = np.max(np.abs(f), axis=0)
+        for _ in range(max_iter):
+            active = ~(norm < tol)
+            if not np.any(active):
+                break
+            jac = np.moveaxis(ie.ComJac(x), [0, 1], [-2, -1])
+            step = np.linalg.solve(jac + 1e-12*np.eye(3), -f.T[..., None])[..., 0].T
+            step = np.where(np.isfinite(step), step, 0)
+            t = np.ones(x.shape[1])
+            for _ in range(20):
+                x_new = np.clip(x + t*step, lower, upper)
+                f_new = ie.ComFuns(x_new)
+                norm_new = np.max(np.abs(f_new), axis=0)
+                better = norm_new < norm
+                if np.all(better | ~active):
+                    break
+                t = np.where(better, t, t/2)
+            accept = active & better
+            x = np.where(accept, x_new, x)
+            f = np.where(accept, f_new, f)
+            norm = np.where(accept, norm_new, norm)
+            if not np.any(accept):
+                break
+    return x, norm, norm < tol
+
+class SweepResult:
+    '''
+    Labelled N-dimensional result of a sweep. land, n_spending, s_spending, residual and converged have
+    one axis per entry of dims, with coordinates coords[dim].
+    '''
+    def __init__(self, dims, coords, x, residual, converged):
+        shape = tuple(len(coords[dim]) for dim in dims)
+        self.dims, self.coords = list(dims), coords
+        self.land, self.n_spending, self.s_spending = [values.reshape(shape) for values in x]
+        self.residual, self.converged = residual.reshape(shape), converged.reshape(shape)
+
+    def ToFrame(self):
+        index = pandas.MultiIndex.from_product([self.coords[dim] for dim in self.dims], names=self.dims)
+        return pandas.DataFrame({'Land': self.land.ravel(), 'NativeSpending': self.n_spending.ravel(),
+                                 'SettlerSpending': self.s_spending.ravel(), 'Residual': self.residual.ravel(),
+                                 'Converged': self.converged.ravel()}, index=index)
+
+def SweepGrid(axes, base=None, tol=1e-10, max_iter=50):
+    '''
+    Solve ComFuns on the full grid spanned by axes, e.g. {'D': np.linspace(0, 100, 101), 'alpha': [0.3, 0.5]}.
+    The grid is swept along its first axis: each slice over the other axes is one vectorized batch, started
+    from the previous slice's solutions (continuation), and points that fail are retried from X_START.
+
+    Parameters:
+    ----------
+        axes (dict): parameter name -> values, in PARAM_NAMES or 'alpha'.
+        base (dict): fixed parameters overriding BASE_PARAMS.
+    '''
+    dims = list(axes)
+    coords = {dim: np.asarray(axes[dim], dtype=float) for dim in dims}
+    mesh = np.meshgrid(*[coords[dim] for dim in dims], indexing='ij')
+    n_slice = mesh[0][0].size
+    x = np.empty((3,) + mesh[0].shape)
+    residual, converged = np.empty(mesh[0].shape), np.zeros(mesh[0].shape, dtype=bool)
+    start = np.repeat(X_START[:, None], n_slice, axis=1).astype(float)
+    for i in range(len(coords[dims[0]])):
+        params = dict(base or {}, **{dim: values[i].ravel() for dim, values in zip(dims, mesh)})
+        ie = ModelBatch(params)
+        x_i, residual_i, converged_i = SolveBatch(ie, start, tol, max_iter)
+        if not np.all(converged_i):
+            cold = ~converged_i
+            x_cold, residual_cold, converged_cold = SolveBatch(ModelBatch(Subset(params, cold)),
+                                                               np.repeat(X_START[:, None], np.count_nonzero(cold), axis=1), tol, max_iter)
+            x_i[:, cold], residual_i[cold], converged_i[cold] = x_cold, residual_cold, converged_cold
+        x[:, i] = x_i.reshape((3,) + mesh[0].shape[1:])
+        residual[i], converged[i] = residual_i.reshape(mesh[0].shape[1:]), converged_i.reshape(mesh[0].shape[1:])
+        start = np.where(converged_i, x_i, start)
+    return SweepResult(dims, coords, x.reshape(3, -1), residual, converged)
+
+def SweepPoints(points, names, base=None, tol=1e-10, max_iter=50, rounds=5):
+    '''
+    Solve ComFuns for a list of parameter vectors (rows of points, columns named by names) as one batch from
+    X_START, then re-seed the points that failed from their nearest converged neighbour (in parameters scaled
+    to unit range) and re-solve them, for up to rounds rounds. Return a SweepResult over the dim 'point'.
+    '''
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    params = dict(base or {}, **{name: points[:, j] for j, name in enumerate(names)})
+    x, residual, converged = SolveBatch(ModelBatch(params), np.repeat(X_START[:, None], len(points), axis=1), tol, max_iter)
+    scale = np.ptp(points, axis=0)
+    scaled = points/np.where(scale > 0, scale, 1)
+    for _ in range(rounds):
+        failed = np.nonzero(~converged)[0]
+        if len(failed) == 0 or not np.any(converged):
+            break
+        done = np.nonzero(converged)[0]
+        _, nearest = cKDTree(scaled[done]).query(scaled[failed])
+        x_f, residual_f, converged_f = SolveBatch(ModelBatch(Subset(params, failed)), x[:, done[nearest]], tol, max_iter)
+        if not np.any(converged_f):
+            break
+        x[:, failed], residual[failed], converged[failed] = x_f, residual_f, converged_f
+    coords = {'point': np.arange(len(points))}
+    result = SweepResult(['point'], coords, x, residual, converged)
+    result.params = pandas.DataFrame(points, columns=names)
+    return result
+
+def Sensitivities(params, x):
+    '''
+    Comparative statics of solved equilibria by the implicit function theorem: d(land, n_spending, s_spending)/d(theta)
+    = -ComJac^-1 ComParamJac, one 3x3 linear solve per equilibrium instead of re-solving at nudged parameters.
+    params as in ModelBatch, one point per column of the (3, n) solutions x. Return a (3, len(SENSITIVITY_NAMES), n)
+    array, nan at points where ComJac is singular.
+    '''
+    x = np.asarray(x, dtype=float).reshape(3, -1)
+    n = x.shape[1]
+    ie = ModelBatch(params)
+    jac = np.moveaxis(np.broadcast_to(ie.ComJac(x), (3, 3, n)), -1, 0)
+    param_jac = np.moveaxis(np.broadcast_to(ie.ComParamJac(x), (3, len(PARAM_NAMES), n)), -1, 0)
+    with np.errstate(all='ignore'):
+        regular = np.isfinite(jac).all(axis=(1, 2)) & (np.linalg.cond(np.where(np.isfinite(jac), jac, 0)) < 1e12)
+    sens = np.full((n, 3, len(PARAM_NAMES)), np.nan)
+    sens[regular] = -np.linalg.solve(jac[regular], param_jac[regular])
+    alpha = sens[:, :, PARAM_NAMES.index('gamma')] + sens[:, :, PARAM_NAMES.index('beta')]
+    return np.moveaxis(np.concatenate([sens, alpha[:, :, None]], axis=2), 0, -1)
+
+def SensitivityTable(params, x, elasticity=False):
+    '''
+    Sensitivities as a DataFrame indexed by (point, variable) with one column per SENSITIVITY_NAMES, or
+    elasticities (d log x / d log theta) if elasticity.
+    '''
+    x = np.asarray(x, dtype=float).reshape(3, -1)
+    sens = Sensitivities(params, x)
+    if elasticity:
+        values = ParamValues(params)
+        theta = np.array([np.broadcast_to(v, x.shape[1]) for v in list(values) + [values[PARAM_NAMES.index('gamma')]]])
+        sens = sens * theta[None]/x[:, None]
+    index = pandas.MultiIndex.from_product([np.arange(x.shape[1]), VARIABLES], names=['point', 'variable'])
+    return pandas.DataFrame(np.moveaxis(sens, -1, 0).reshape(-1, len(SENSITIVITY_NAMES)), index=index, columns=SENSITIVITY_NAMES)
@@ -0,0 +1,123 @@
+### Exact treaty duration, ending-reason and transfer distributions from an absorbing Markov chain ###
+
+import numpy as np
+import pandas
+from Treaty_simulation import ie, pd, dp, TotalTreatyBenefits
+
+ENDING_REASONS = ['MatchEnding', 'NativeBroken', 'SettlerBroken', 'BothBroken']
+NATIVE_ENDING = 0.2 # mean of Treaty.end_treaty's uniform(0, 0.4) native ending probability
+
+def LogitNormalMean(x, sd, nodes=40):
+    '''
+    E[1/(1 + exp(x + noise))] for noise ~ N(0, sd^2), by Gauss-Hermite quadrature, elementwise in x.
+    '''
+    points, weights = np.polynomial.hermite.hermgauss(nodes)
+    x = np.asarray(x, dtype=float)[..., None]
+    return np.sum(weights/(1 + np.exp(x + np.sqrt(2) * sd * points)), axis=-1)/np.sqrt(np.pi)
+
+def ProposalHazard(tr, s_land, s_spending, nodes=40):
+    '''
+    Probability that tr proposes a treaty, propose_treaty integrated over its noise.
+    '''
+    return LogitNormalMean(tr.c - tr.a*np.asarray(s_spending) - tr.b*(100 - np.asarray(s_land)), tr.noise_sd, nodes)
+
+class TreatyChain:
+    '''
+    The treaty phase of TreatyRows as an absorbing Markov chain over (treaty land, period). A treaty accepted in
+    period t on settler land L has a row each period; after a row in period t the match goes on with probability
+    1 - prob (0 in period max_periods), or ends (MatchEnding); if it goes on, the settler breaks with the
+    probability end_treaty gives, integrated over its noise, and the Native with NATIVE_ENDING, independently.
+    Treaty lands are drawn as content_treaty does. The chain is propagated for every land and start period at
+    once, so every distribution is exact up to the quadrature.
+
+    Parameters:
+    ----------
+    tr: Treaty instance (its a..e, noise_sd, payments and land distribution are used).
+    prob (float): probability to end the match each period, pd.prob in Treaty_simulation.
+    max_periods (int): cap of the match length, as in TreatyRows.
+    nodes (int): Gauss-Hermite nodes of the noise integrals.
+    '''
+    def __init__(self, tr, prob=pd.prob, max_periods=20, nodes=40):
+        self.tr, self.prob, self.max_periods = tr, prob, max_periods
+        self.lands, self.land_probs = tr.land_choices, tr.land_probs
+        settler = LogitNormalMean(tr.e - tr.d*(100 - self.lands), tr.noise_sd, nodes)
+        native = NATIVE_ENDING
+        self.breaks = np.stack([(1 - settler)*native, settler*(1 - native), settler*native], axis=1) # (lands, 3) broken reasons
+        self.stay = (1 - settler)*(1 - native)
+        periods = np.arange(1, max_periods + 1)
+        self.match_goes_on = np.where(periods < max_periods, 1 - prob, 0.) # after a row in period t
+        self.length_probs, self.reason_probs = self.Propagate()
+
+    def Propagate(self):
+        '''
+        Return P(length = k, reason) as a (start period, land, k, reason) array and its sum over k, for start
+        periods 1..max_periods (row t-1 for period t) and lengths 1..max_periods.
+        '''
+        T, n_lands = self.max_periods, len(self.lands)
+        joint = np.zeros((T, n_lands, T, len(ENDING_REASONS)))
+        alive = np.ones((T, n_lands)) # P(treaty still running at its k-th row), one row per start period
+        starts = np.arange(T)
+        for k in range(T):
+            period = starts + k # period of the k-th row, 0-based
+            valid = period < T
+            goes_on = np.where(valid, self.match_goes_on[np.minimum(period, T - 1)], 0.)[:, None]
+            joint[:, :, k, 0] = np.where(valid[:, None], alive * (1 - goes_on), 0.)
+            joint[:, :, k, 1:] = (alive * goes_on)[:, :, None] * self.breaks[None]
+            alive = alive * goes_on * self.stay[None]
+        return joint, joint.sum(axis=2)
+
+    def Distribution(self, start_probs):
+        '''
+        Mix the chain over start periods. start_probs[t-1] is the probability (or weight) that a treaty starts
+        in period t. Return the (length, reason) joint probabilities as a DataFrame indexed by length 1..max_periods,
+        normalized to the treaties that start.
+        '''
+        weights = np.asarray(start_probs, dtype=float)
+        weights = weights/weights.sum()
+        joint = np.einsum('t,l,tlkr->kr', weights, self.land_probs, self.length_probs)
+        return pandas.DataFrame(joint, index=pandas.Index(np.arange(1, self.max_periods + 1), name='TreatyLength'),
+                                columns=ENDING_REASONS)
+
+    def Summary(self, start_probs, transfers=None):
+        '''
+        Expected treaty length, ending-reason shares and, given transfers[t-1] (the payment agreed in a treaty
+        starting in period t, see FirstTreaty), expected total transfers: the annuity is paid on every treaty
+        row, the lumpsum once.
+        '''
+        joint = self.Distribution(start_probs)
+        lengths = joint.index.values
+        summary = {'ExpectedLength': np.sum(joint.values.sum(axis=1) * lengths),
+                   'LengthSd': np.sqrt(np.sum(joint.values.sum(axis=1) * lengths**2) - np.sum(joint.values.sum(axis=1) * lengths)**2)}
+        summary.update({'Share_' + reason: joint[reason].sum() for reason in ENDING_REASONS})
+        if transfers is not None:
+            weights = np.asarray(start_probs, dtype=float)/np.sum(start_probs)
+            expected_rows = np.einsum('l,tlkr,k->t', self.land_probs, self.length_probs, lengths)
+            for treatment, payment in [('annuity', self.tr.annuity_payment), ('lumpsum', self.tr.lumpsum_payment)]:
+                amount = np.asarray(transfers[treatment], dtype=float)
+                rows = expected_rows if treatment == 'annuity' else 1
+                summary['Transfer_' + treatment] = np.sum(weights * amount * rows)
+        return pandas.Series(summary)
+
+def FirstTreaty(tr, n_land_start=65, max_periods=20, endowments=100, prob=pd.prob, nodes=40):
+    '''
+    Path of a match without spending shocks until its first treaty, as TreatyRows plays it with
+    spending_shock=False: the fights follow dp's period equilibria, and from period 2 a treaty is proposed
+    with ProposalHazard and accepted. Return the probability that the first treaty starts in each period
+    1..max_periods (the rest is no treaty) and the transfer agreed by each treatment at each start.
+    '''
+    start_probs, transfers = np.zeros(max_periods), {'annuity': np.zeros(max_periods), 'lumpsum': np.zeros(max_periods)}
+    no_treaty, n_land, s_savings = 1., n_land_start, endowments
+    for t in range(1, max_periods + 1):
+        reached = (1 - prob)**(t - 1) # P(match lasts t periods or more)
+        s_savings_end = s_savings + ie.SettlerIncome(100 - n_land)
+        if t >= 2:
+            hazard = ProposalHazard(tr, 100 - n_land, s_spending, nodes)
+            start_probs[t-1] = reached * no_treaty * hazard
+            no_treaty *= 1 - hazard
+            benefits = TotalTreatyBenefits(n_land, n_spending, s_spending)
+            transfers['annuity'][t-1] = min(tr.annuity_payment * benefits, s_savings_end)
+            transfers['lumpsum'][t-1] = min(tr.lumpsum_payment * benefits, s_savings_end)
+        _, _, (n_spending, s_spending), _ = dp.PeriodEquilibrium(n_land, t)
+        s_savings = s_savings_end - s_spending
+        n_land += dp.IfEqSpending(n_land, [n_spending, s_spending], simulation=True)
+    return start_probs, transfers
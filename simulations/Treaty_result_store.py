@@ -0,0 +1,193 @@
+### Content-addressed store of simulation results, with incremental checkpoints to resume interrupted runs ###
+
+import os
+import glob
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas
+from Treaty_game_model import RandomStream
+import Treaty_game_model
+import Treaty_simulation as simulation
+from Treaty_game_runner import PROFIT_COLUMNS
+
+STORE_VERSION = 1
+UNKEYED_OPTIONS = ('tracer', 'record', 'keep_last', 'dtype') # instrumentation and recording, not in the stored results
+
+def CodeVersion(modules=(Treaty_game_model, simulation)):
+    '''
+    Hash of the source of the modules results depend on, so that editing them invalidates the store.
+    '''
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read().replace(b'\r\n', b'\n'))
+    return digest.hexdigest()[:16]
+
+def Jsonable(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (np.ndarray, tuple)):
+        return list(value)
+    return str(value)
+
+def OptionsConfig(kwargs):
+    '''
+    The keyword options of a stored run as part of its config. UNKEYED_OPTIONS are left out, and the others must
+    be JSON values (numpy scalars and arrays included), since the str() of other objects, e.g. a Tracer, differs
+    from process to process and would give every run a new key.
+    '''
+    def Strict(value):
+        if isinstance(value, (np.generic, np.ndarray)):
+            return value.tolist()
+        raise TypeError('Option value {!r} is not a JSON value and cannot key a stored run!'.format(value))
+    options = {name: value for name, value in kwargs.items() if name not in UNKEYED_OPTIONS}
+    return json.loads(json.dumps(options, sort_keys=True, default=Strict))
+
+def ModelConfig(dp):
+    return {'model': dp.ModelKey(), 'prob': dp.pd.prob, 'n_default': dp.pd.n_dft}
+
+def TreatyConfig(tr, treatment):
+    return {'coefficients': [tr.a, tr.b, tr.c, tr.d, tr.e], 's_efficiency': tr.s_efficiency, 'noise_sd': tr.noise_sd,
+            'payments': [tr.annuity_payment, tr.lumpsum_payment], 'treatment': treatment}
+
+class ResultStore:
+    '''
+    Results on disk keyed by a hash of their full configuration and of the code version: <directory>/<key>/
+    holds config.json, checkpoint-<n>.pkl files while a run is in progress and result.pkl once it is done.
+    Every file is written to a .tmp file and renamed, so an interruption never leaves a partial file.
+
+    Parameters:
+    ----------
+    directory (str): root of the store.
+    version (str): code version mixed into every key, CodeVersion() by default.
+    '''
+    def __init__(self, directory, version=None):
+        self.directory = directory
+        self.version = CodeVersion() if version is None else version
+        os.makedirs(directory, exist_ok=True)
+
+    def Key(self, config):
+        text = json.dumps({'store_version': STORE_VERSION, 'code_version': self.version, 'config': config},
+                          sort_keys=True, default=Jsonable)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def Path(self, config):
+        path = os.path.join(self.directory, self.Key(config))
+        if not os.path.exists(os.path.join(path, 'config.json')):
+            os.makedirs(path, exist_ok=True)
+            self.Write(os.path.join(path, 'config.json'), json.dumps(config, sort_keys=True, indent=1, default=Jsonable).encode())
+        return path
+
+    def Write(self, path, data):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def Load(self, config):
+        '''
+        Return the stored result of config, or None.
+        '''
+        path = os.path.join(self.directory, self.Key(config), 'result.pkl')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def Save(self, config, result):
+        '''
+        Store the final result of config and drop its checkpoints.
+        '''
+        path = self.Path(config)
+        self.Write(os.path.join(path, 'result.pkl'), pickle.dumps(result))
+        for checkpoint in glob.glob(os.path.join(path, 'checkpoint-*.pkl')):
+            os.remove(checkpoint)
+
+    def Checkpoint(self, config, index, payload):
+        self.Write(os.path.join(self.Path(config), 'checkpoint-{:06d}.pkl'.format(index)), pickle.dumps(payload))
+
+    def Checkpoints(self, config):
+        '''
+        Return the checkpoint payloads of config in order.
+        '''
+        payloads = []
+        for checkpoint in sorted(glob.glob(os.path.join(self.directory, self.Key(config), 'checkpoint-*.pkl'))):
+            with open(checkpoint, 'rb') as f:
+                payloads.append(pickle.load(f))
+        return payloads
+
+def StoredTreatySimulation(store, n_land_start, tr, treatment, seed, matches=100, **kwargs):
+    '''
+    TreatySimulation of tr with draws from RandomStream(seed) (tr itself is not changed), checkpointed after
+    every match with the stream state, so that an interrupted run resumes at the next match. A configuration
+    already run is returned from store. kwargs are passed to TreatyRows.
+    '''
+    if seed is None:
+        raise ValueError('A stored run needs a seed to be reproducible!')
+    config = dict(ModelConfig(simulation.dp), treaty=TreatyConfig(tr, treatment), kind='TreatySimulation',
+                  n_land_start=n_land_start, seed=seed, matches=matches, options=OptionsConfig(kwargs))
+    result = store.Load(config)
+    if result is not None:
+        return result
+    checkpoints = store.Checkpoints(config)
+    rows = [row for payload in checkpoints for row in payload['rows']]
+    stream = checkpoints[-1]['stream'] if checkpoints else RandomStream(seed)
+    tr = simulation.Treaty(tr.s_efficiency, tr.a, tr.b, tr.c, tr.d, tr.e, tr.noise_sd, tr.annuity_payment,
+                           tr.lumpsum_payment, stream=stream)
+    for match in range(len(checkpoints) + 1, matches + 1): # one match at a time draws the same as all at once
+        match_rows = [[match] + row[1:] for row in simulation.TreatyRows(n_land_start, tr, treatment, matches=1, **kwargs)]
+        rows.extend(match_rows)
+        store.Checkpoint(config, match, {'rows': match_rows, 'stream': stream})
+    result = pandas.DataFrame(data=rows, columns=simulation.SIMULATION_COLUMNS)
+    store.Save(config, result)
+    return result
+
+def StoredExperiment(store, seed, n_subs=50, n_land_start=65, matches=4, **kwargs):
+    '''
+    The Treaty_simulation driver through store: subject i is drawn from the i-th child of SeedSequence(seed)
+    and simulated by StoredTreatySimulation, so every finished subject (and match) is on disk as soon as it
+    is done. Return the DataFrame with SubId that the driver writes to SimulatedData.csv.
+    '''
+    if seed is None:
+        raise ValueError('A stored run needs a seed to be reproducible!')
+    config = dict(ModelConfig(simulation.dp), kind='Experiment', n_subs=n_subs, seed=seed,
+                  n_land_start=n_land_start, matches=matches, options=OptionsConfig(kwargs))
+    result = store.Load(config)
+    if result is not None:
+        return result
+    all_data = []
+    for i, subject_seed in enumerate(np.random.SeedSequence(seed).spawn(n_subs), 1):
+        draw_seed, stream_seed = subject_seed.generate_state(2)
+        tr, treatment = simulation.DrawSubject(np.random.default_rng(draw_seed))
+        data = StoredTreatySimulation(store, n_land_start, tr, str(treatment), int(stream_seed), matches, **kwargs)
+        all_data.append(data.assign(SubId=100+i)[['SubId'] + simulation.SIMULATION_COLUMNS])
+    result = pandas.concat(all_data, ignore_index=True)
+    store.Save(config, result)
+    return result
+
+def StoredSimulations(store, dp, n_land, seed, n=200, checkpoint_every=10, **kwargs):
+    '''
+    n runs of dp.Simulation, as in the profits study, checkpointed every checkpoint_every runs. Run i draws
+    its uncertainty periods and shocks from the i-th child of SeedSequence(seed), so a resumed batch gives
+    the same table. Return a DataFrame with columns TotalPeriods, NativeProfit, SettlerProfit.
+    kwargs are passed to dp.Simulation.
+    '''
+    if seed is None:
+        raise ValueError('A stored run needs a seed to be reproducible!')
+    config = dict(ModelConfig(dp), kind='Simulation', n_land=n_land, n=n, seed=seed, options=OptionsConfig(kwargs))
+    result = store.Load(config)
+    if result is not None:
+        return result
+    runs = [run for payload in store.Checkpoints(config) for run in payload]
+    seeds = np.random.SeedSequence(seed).spawn(n)
+    for start in range(len(runs), n, checkpoint_every):
+        chunk = []
+        for run_seed in seeds[start:start + checkpoint_every]:
+            rng = np.random.default_rng(run_seed)
+            chunk.append(dp.Simulation(n_land, int(rng.geometric(dp.pd.prob)), rng=rng, **kwargs))
+        runs.extend(chunk)
+        store.Checkpoint(config, start, chunk)
+    result = pandas.DataFrame(runs, columns=PROFIT_COLUMNS)
+    store.Save(config, result)
+    return result
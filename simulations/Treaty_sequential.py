@@ -0,0 +1,160 @@
+### Precision-targeted Monte Carlo: replications run in batches until the confidence intervals are narrow enough ###
+
+from functools import partial
+from statistics import NormalDist
+import numpy as np
+import pandas
+from Treaty_game_model import RandomStream
+import Treaty_simulation as simulation
+
+ENDING_REASONS = ['MatchEnding', 'NativeBroken', 'SettlerBroken', 'BothBroken']
+RUN_OPTIONS = ['level', 'batch', 'min_reps', 'max_reps', 'seed', 'mapper', 'verbose'] # SequentialMonteCarlo's own keywords
+
+class RunningRatios:
+    '''
+    Running sums of (numerator, denominator) pairs, one pair per replication and statistic. A statistic is
+    the ratio of the summed numerators to the summed denominators (a plain mean when every denominator is 1),
+    with its standard error by the delta method, so that e.g. treaty length pools the treaties of all
+    replications while replications stay the independent unit.
+    '''
+    def __init__(self, names):
+        self.names = list(names)
+        self.n = 0
+        self.sums = np.zeros((5, len(self.names))) # num, den, num*num, den*den, num*den
+
+    def Add(self, num, den):
+        num, den = np.atleast_2d(num), np.atleast_2d(den)
+        self.n += len(num)
+        self.sums += [num.sum(axis=0), den.sum(axis=0), (num*num).sum(axis=0), (den*den).sum(axis=0), (num*den).sum(axis=0)]
+
+    def Estimate(self):
+        '''
+        Return the ratios and their standard errors (nan while a statistic has no denominator or n < 2).
+        '''
+        s_num, s_den, s_nn, s_dd, s_nd = self.sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(s_den != 0, s_num/s_den, np.nan)
+            residual = np.maximum(s_nn - 2*ratio*s_nd + ratio**2*s_dd, 0)/(self.n - 1) # variance of num - ratio*den
+            se = np.sqrt(residual*self.n)/np.abs(s_den) if self.n > 1 else np.full(len(self.names), np.nan)
+        return ratio, se
+
+class SequentialResult:
+    '''
+    Outcome of SequentialMonteCarlo: estimate, se, half_width and converged per statistic, the number of
+    replications used and one history row per batch.
+    '''
+    def __init__(self, names, estimate, se, half_width, converged, replications, history):
+        self.names, self.estimate, self.se, self.half_width = names, estimate, se, half_width
+        self.converged, self.replications, self.history = converged, replications, history
+
+    def ToFrame(self):
+        return pandas.DataFrame({'Estimate': self.estimate, 'StdErr': self.se, 'Lower': self.estimate - self.half_width,
+                                 'Upper': self.estimate + self.half_width, 'HalfWidth': self.half_width,
+                                 'Converged': self.converged}, index=pandas.Index(self.names, name='Statistic'))
+
+def Pair(value):
+    return (value, 1) if np.ndim(value) == 0 else value
+
+def SplitOptions(kwargs):
+    return {key: kwargs.pop(key) for key in RUN_OPTIONS if key in kwargs}
+
+def SequentialMonteCarlo(replicate, statistics, abs_tol=None, rel_tol=None, level=0.95, batch=10,
+                         min_reps=20, max_reps=10000, seed=None, mapper=map, verbose=False):
+    '''
+    Run replicate in batches and stop as soon as every targeted statistic's confidence interval is within
+    its tolerance, or after max_reps replications. Replication i gets the i-th child of SeedSequence(seed),
+    so the replications do not depend on batch or mapper.
+
+    Parameters:
+    ----------
+        replicate (callable): seed sequence -> result of one replication; must pickle if mapper is a pool's map.
+        statistics (dict): name -> function of a result, returning a value or a (numerator, denominator) pair.
+        abs_tol (dict): name -> largest half-width of the interval.
+        rel_tol (dict): name -> largest half-width relative to the estimate. Statistics in neither dict are
+            reported but do not hold up stopping.
+        level (float): confidence level of the intervals.
+        batch (int): replications between two checks.
+        min_reps (int): replications before stopping is allowed.
+        max_reps (int): replications after which the run stops anyway.
+        mapper (callable): map-like function running a batch, e.g. a ProcessPoolExecutor's map.
+    '''
+    abs_tol, rel_tol = abs_tol or {}, rel_tol or {}
+    unknown = (set(abs_tol) | set(rel_tol)) - set(statistics)
+    if unknown:
+        raise ValueError('No statistic named {}!'.format(', '.join(sorted(unknown))))
+    names = list(statistics)
+    absolute = np.array([abs_tol.get(name, np.nan) for name in names], dtype=float)
+    relative = np.array([rel_tol.get(name, np.nan) for name in names], dtype=float)
+    targeted = ~(np.isnan(absolute) & np.isnan(relative))
+    z = NormalDist().inv_cdf((1 + level)/2)
+    ratios, seed_seq, history = RunningRatios(names), np.random.SeedSequence(seed), []
+    while True:
+        results = list(mapper(replicate, seed_seq.spawn(min(batch, max_reps - ratios.n))))
+        pairs = np.array([[Pair(fun(res)) for fun in statistics.values()] for res in results], dtype=float)
+        ratios.Add(pairs[:, :, 0], pairs[:, :, 1])
+        estimate, se = ratios.Estimate()
+        half_width = z*se
+        with np.errstate(invalid='ignore'):
+            converged = (half_width <= absolute) | (half_width <= relative*np.abs(estimate))
+        history.append(dict(zip(names, half_width), replications=ratios.n))
+        if verbose:
+            print('{} replications, {} of {} targets met'.format(ratios.n, np.sum(converged & targeted), np.sum(targeted)))
+        if (ratios.n >= min_reps and np.all(converged[targeted])) or ratios.n >= max_reps:
+            return SequentialResult(names, estimate, se, half_width, converged, ratios.n, pandas.DataFrame(history))
+
+def TreatySubject(seed, n_land_start=65, matches=4, **kwargs):
+    '''
+    One replication of the Treaty_simulation driver: draw a subject and simulate its matches, all draws
+    taken from seed. kwargs are passed to TreatySimulation.
+    '''
+    subject_seed, stream_seed = seed.spawn(2)
+    tr, treatment = simulation.DrawSubject(np.random.default_rng(subject_seed), RandomStream(stream_seed))
+    return simulation.TreatySimulation(n_land_start, tr, treatment, matches=matches, **kwargs)
+
+def TreatyEnds(data):
+    return data[data.TreatyEndingReason.notna() & (data.TreatyEndingReason != 'ContinueTreaty')]
+
+def TreatyLength(data, treatment):
+    ends = TreatyEnds(data)
+    lengths = ends.TreatyPeriod[ends.Treatment == treatment]
+    return lengths.sum(), len(lengths)
+
+def EndingShare(data, reason):
+    reasons = TreatyEnds(data).TreatyEndingReason
+    return np.sum(reasons == reason), len(reasons)
+
+def FinalSaving(data, column):
+    final = data.groupby('Match')[column].last()
+    return final.sum(), len(final)
+
+TREATY_STATISTICS = dict({'TreatyLength_' + t: partial(TreatyLength, treatment=t) for t in ['annuity', 'lumpsum']},
+                         **{'Share_' + reason: partial(EndingShare, reason=reason) for reason in ENDING_REASONS},
+                         FinalNativeSaving=partial(FinalSaving, column='EndNativeSaving'),
+                         FinalSettlerSaving=partial(FinalSaving, column='EndSettlerSaving'))
+
+def TreatyStudy(abs_tol=None, rel_tol=None, n_land_start=65, matches=4, statistics=TREATY_STATISTICS, **kwargs):
+    '''
+    SequentialMonteCarlo over subjects of TreatySimulation, replacing the fixed n_subs = 50 of the driver.
+    Treaty lengths and ending shares pool the treaties of all subjects, final savings the matches. kwargs
+    other than SequentialMonteCarlo's are passed to TreatySimulation.
+    '''
+    run_kwargs = SplitOptions(kwargs)
+    replicate = partial(TreatySubject, n_land_start=n_land_start, matches=matches, **kwargs)
+    return SequentialMonteCarlo(replicate, statistics, abs_tol, rel_tol, **run_kwargs)
+
+def ProfitRun(seed, dp, n_land=65, **kwargs):
+    '''
+    One run of the profits study: uncertainty periods drawn geometric with dp.pd.prob, then dp.Simulation.
+    '''
+    rng = np.random.default_rng(seed)
+    return dp.Simulation(n_land, int(rng.geometric(dp.pd.prob)), rng=rng, **kwargs)
+
+PROFIT_STATISTICS = {'TotalPeriods': lambda res: res[0], 'NativeProfit': lambda res: res[1], 'SettlerProfit': lambda res: res[2]}
+
+def ProfitStudy(dp, abs_tol=None, rel_tol=None, n_land=65, statistics=PROFIT_STATISTICS, **kwargs):
+    '''
+    SequentialMonteCarlo over runs of dp.Simulation, replacing the 200 runs of the profits notebook. kwargs
+    other than SequentialMonteCarlo's are passed to dp.Simulation (saving, shock, incremental...).
+    '''
+    run_kwargs = SplitOptions(kwargs)
+    return SequentialMonteCarlo(partial(ProfitRun, dp=dp, n_land=n_land, **kwargs), statistics, abs_tol, rel_tol, **run_kwargs)
@@ -1,27 +1,48 @@
+import time
 import numpy as np
 import pandas
 from math import isclose
-from Treaty_game_model import ie, pd, dp
+from Treaty_game_model import IncomeExpansion, NaivePlayerDecision, DP, EquilibriumCache
+
+ie = IncomeExpansion(120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+pd = NaivePlayerDecision(ie, 1/6, 10)
+dp = DP(ie, pd, cache=EquilibriumCache()) # every match starts from the same land, so most periods are cache hits
+
+SIMULATION_COLUMNS = ['Match', 'CurrentPeriod', 'NativeSpending', 'SettlerSpending', 'InitNativeSaving', 'EndNativeSaving', 'InitSettlerSaving', 'EndSettlerSaving', 
+                      'InitNativeLand', 'EndNativeLand', 'InitSettlerLand','EndSettlerLand', 'NativeIncome','SettlerIncome', 'Treatment','TreatyPeriod', 'TreatyPayment', 'TreatyEndingReason']
 
 class Treaty:
+    '''
+    A subject's treaty behaviour. Draws come from stream (a RandomStream), or from the global np.random
+    state if it is None, as do TreatyRows' own draws for this subject.
+    '''
     def __init__(self, s_efficiency, a, b, c, d, e, noise_sd, 
-                 annuity_payment=1/2, lumpsum_payment=1.5):
+                 annuity_payment=1/2, lumpsum_payment=1.5, stream=None):
         self.a, self.b, self.c, self.d, self.e = a, b, c, d, e
         self.s_efficiency = s_efficiency
         self.noise_sd = noise_sd
         self.annuity_payment = annuity_payment
         self.lumpsum_payment = lumpsum_payment
+        self.stream = stream
+        self.rng = np.random if stream is None else stream
+        if s_efficiency is not None: # treaty-land distribution, built once instead of on every proposal
+            self.land_choices = np.arange(50, s_efficiency+1)
+            self.land_probs = self.land_choices/np.sum(self.land_choices)
+            self.land_cdf = np.cumsum(self.land_probs)
         
-    def propose_treaty(self, s_land, s_spending):
+    def propose_treaty(self, s_land, s_spending, noise=None):
         a, b, c = self.a, self.b, self.c
-        noise = np.random.normal(scale=self.noise_sd)
+        if noise is None:
+            noise = self.rng.normal(scale=self.noise_sd)
         exp = np.exp(c -a*s_spending - b*(100-s_land) + noise )
         return 1/(1 + exp)
     
     def content_treaty(self, s_land, total_treaty_benefits, s_savings,
                        treaty_type='annuity'):
-        land_choices = np.arange(50, self.s_efficiency+1) 
-        s_treaty_land = np.random.choice(land_choices, p=land_choices/np.sum(land_choices))
+        if self.stream is None:
+            s_treaty_land = np.random.choice(self.land_choices, p=self.land_probs)
+        else:
+            s_treaty_land = self.stream.Choice(self.land_choices, self.land_cdf)
         if treaty_type == 'annuity':
             transfer = self.annuity_payment * total_treaty_benefits
         else:
@@ -33,11 +54,13 @@ class Treaty:
     def accept_treaty(self):
         return 1
     
-    def end_treaty(self, s_treaty_land):
-        noise = np.random.normal(scale=self.noise_sd)
+    def end_treaty(self, s_treaty_land, noise=None, p_native_ending=None):
+        if noise is None:
+            noise = self.rng.normal(scale=self.noise_sd)
         exp = np.exp(self.e - self.d*(100 - s_treaty_land) + noise)
         p_settler_ending = 1/(1+exp)
-        p_native_ending = np.random.uniform(0, 0.4)
+        if p_native_ending is None:
+            p_native_ending = self.rng.uniform(0, 0.4)
         return p_settler_ending, p_native_ending
 
 def TotalTreatyBenefits(n_land, n_spending, s_spending):
@@ -55,13 +78,12 @@ def TreatyEndingReason(draw_s_ending, draw_n_ending, s_ending, n_ending):
     else:
         return 'NativeBroken'
 
-def SpendingExpansion(n_land, current_period, spending_shock, n_savings, s_savings, spending_shock_size):
-    spendings, responses = dp.ResponseList(n_land, current_period)
-    eq_spending = dp.FindNE(spendings, responses)
+def SpendingExpansion(n_land, current_period, spending_shock, n_savings, s_savings, spending_shock_size, rng=None):
+    spendings, responses, eq_spending, _ = dp.PeriodEquilibrium(n_land, current_period)
     if spending_shock:
         eq_spending = dp.SpendingShocks(spendings[0][-1], eq_spending[0], 
                                         spendings[1][-1], eq_spending[1], 
-                                        spending_shock_size)
+                                        spending_shock_size, rng)
     n_spending, s_spending = eq_spending 
     n_savings -= n_spending
     s_savings -= s_spending
@@ -79,18 +101,28 @@ def TreatySavingsChange(n_savings, s_savings, n_land, s_treaty_land, transfer, t
         s_savings += ie.SettlerIncome(s_treaty_land)
     return n_savings, s_savings
         
-def TreatySimulation(n_land_start, tr,
-                     treatment,
-                     max_periods = 20, 
-                     matches=100, 
-                     endowments=100,
-                     spending_shock=True,
-                     spending_shock_size=(0, 2)):
-    match_obs = []
+def TreatyRows(n_land_start, tr,
+               treatment,
+               max_periods = 20, 
+               matches=100, 
+               endowments=100,
+               spending_shock=True,
+               spending_shock_size=(0, 2),
+               tracer=None):
+    '''
+    Generator behind TreatySimulation. Yield the rows (lists in SIMULATION_COLUMNS order) one match at a time,
+    so only the current match is held in memory. An optional Tracer counts treaty proposals, acceptances and
+    endings by reason, and gets one 'match' record per match (attach it to dp as well for the period phases).
+    All draws come from tr.rng, that is tr.stream or the global np.random state.
+    '''
+    rng = tr.rng
     for match in range(1, matches+1):
+        if tracer is not None:
+            match_start, match_time = tracer.Snapshot(), time.perf_counter()
+        match_obs = []
         treaty_type = treatment
         #treaty_type = np.random.choice(['annuity', 'lumpsum'], p=[1/2, 1/2])
-        tot_periods = min(max_periods, np.random.geometric(pd.prob))
+        tot_periods = min(max_periods, rng.geometric(pd.prob))
         n_savings_init = s_savings_init = endowments
         current_period = 1
         have_treaty = False
@@ -102,11 +134,15 @@ def TreatySimulation(n_land_start, tr,
             s_savings_end = s_savings_init + s_income
             if current_period >= 2 and match_obs[-1][-1] == None:
                 prob_tr = tr.propose_treaty(100-n_land_init, s_spending)
-                if np.random.random() < prob_tr:  # propose a treaty
+                if rng.random() < prob_tr:  # propose a treaty
+                    if tracer is not None:
+                        tracer.Count('treaty_proposals')
                     total_treaty_benefits = TotalTreatyBenefits(n_land_init, n_spending, s_spending)
                     s_treaty_land, transfer = tr.content_treaty(100-n_land_init, total_treaty_benefits,
                                                             s_savings_end, treaty_type)   # treaty content
-                    if np.random.random() < tr.accept_treaty(): # accept a treaty
+                    if rng.random() < tr.accept_treaty(): # accept a treaty
+                        if tracer is not None:
+                            tracer.Count('treaty_accepted')
                         n_land_end = 100 - s_treaty_land
                         n_savings_end += transfer
                         s_savings_end -= transfer
@@ -123,7 +159,7 @@ def TreatySimulation(n_land_start, tr,
                             if current_period > tot_periods:
                                 match_obs[-1][-1] = 'MatchEnding'
                                 break
-                            draw_s_ending, draw_n_ending = np.random.random(2)
+                            draw_s_ending, draw_n_ending = rng.random(), rng.random()
                             s_ending, n_ending = tr.end_treaty(s_treaty_land)
                             treaty_status = TreatyEndingReason(draw_s_ending, draw_n_ending, s_ending, n_ending)
                             if treaty_status == 'ContinueTreaty':
@@ -142,6 +178,8 @@ def TreatySimulation(n_land_start, tr,
                             s_savings_init = s_savings_end
                             n_land_init = n_land_end
                             n_savings_end, s_savings_end = TreatySavingsChange(n_savings_init, s_savings_init, n_land_init, s_treaty_land, transfer, treaty_type)
+                        if tracer is not None:
+                            tracer.Count('treaty_' + match_obs[-1][-1])
                         if have_treaty and match_obs[-1][-1] != None and current_period <= tot_periods:
                             have_treaty = False
                             n_savings_init = n_savings_end
@@ -166,7 +204,7 @@ def TreatySimulation(n_land_start, tr,
                 pass  
             if (current_period <= tot_periods) and (current_period == 1 or not have_treaty):
                 n_spending, s_spending, n_savings_end, s_savings_end, n_land_diff = SpendingExpansion(
-                    n_land_init, current_period, spending_shock, n_savings_end, s_savings_end, spending_shock_size)  # fighting results
+                    n_land_init, current_period, spending_shock, n_savings_end, s_savings_end, spending_shock_size, tr.stream)  # fighting results
                 n_land_end = n_land_init + n_land_diff
                 obs = [match, current_period, n_spending, s_spending, n_savings_init, n_savings_end, s_savings_init, 
                        s_savings_end,  n_land_init, n_land_end, 100-n_land_init, 100-n_land_end, n_income, s_income, np.nan, None, np.nan, None]
@@ -176,22 +214,40 @@ def TreatySimulation(n_land_start, tr,
                 n_savings_init = n_savings_end
                 s_savings_init = s_savings_end
                 match_obs.append(obs)
-    cols = ['Match', 'CurrentPeriod', 'NativeSpending', 'SettlerSpending', 'InitNativeSaving', 'EndNativeSaving', 'InitSettlerSaving', 'EndSettlerSaving', 
-            'InitNativeLand', 'EndNativeLand', 'InitSettlerLand','EndSettlerLand', 'NativeIncome','SettlerIncome', 'Treatment','TreatyPeriod', 'TreatyPayment', 'TreatyEndingReason']
-    simulated_data = pandas.DataFrame(data=match_obs,  columns=cols)
+        if tracer is not None:
+            tracer.Record('match', tracer.Since(match_start), source='TreatySimulation', match=match, periods=tot_periods,
+                          treaty_periods=sum(obs[15] is not None for obs in match_obs), time=time.perf_counter() - match_time)
+        yield from match_obs
+
+def TreatySimulation(n_land_start, tr,
+                     treatment,
+                     max_periods = 20, 
+                     matches=100, 
+                     endowments=100,
+                     spending_shock=True,
+                     spending_shock_size=(0, 2),
+                     tracer=None):
+    match_obs = list(TreatyRows(n_land_start, tr, treatment, max_periods, matches, endowments,
+                                spending_shock, spending_shock_size, tracer))
+    simulated_data = pandas.DataFrame(data=match_obs,  columns=SIMULATION_COLUMNS)
     return simulated_data
 
-n_subs = 50
-all_data = []
-for i in range(1, n_subs+1):
+def DrawSubject(rng=np.random, stream=None):
     mean = [1/20, 1/30, 0, 1/25, 2]
     cov = np.diag([0.2, 0.1, 1, 0.1, 0.2])
-    a, b, c, d, e = np.random.multivariate_normal(mean=mean, cov=cov)
-    tr = Treaty(ie.global_efficiency, a, b, c, d, e, 2)
-    treatment = np.random.choice(['annuity', 'lumpsum'], p=[1/2, 1/2])
-    data = TreatySimulation(65, tr, treatment, matches=4)
-    data.insert(0, 'SubId', 100+i)
-    all_data.append(data)
-res = pandas.concat(all_data)
-res.to_csv('SimulatedData.csv', index=False,  float_format='%.0f')
+    a, b, c, d, e = rng.multivariate_normal(mean=mean, cov=cov)
+    tr = Treaty(ie.global_efficiency, a, b, c, d, e, 2, stream=stream)
+    treatment = rng.choice(['annuity', 'lumpsum'], p=[1/2, 1/2])
+    return tr, treatment
+
+if __name__ == "__main__":
+    n_subs = 50
+    all_data = []
+    for i in range(1, n_subs+1):
+        tr, treatment = DrawSubject()
+        data = TreatySimulation(65, tr, treatment, matches=4)
+        data.insert(0, 'SubId', 100+i)
+        all_data.append(data)
+    res = pandas.concat(all_data)
+    res.to_csv('SimulatedData.csv', index=False,  float_format='%.0f')
 
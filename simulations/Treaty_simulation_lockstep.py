@@ -0,0 +1,194 @@
+### Lockstep, struct-of-arrays version of TreatySimulation ###
+
+import numpy as np
+import pandas
+from Treaty_simulation import ie, pd, dp, Treaty, TotalTreatyBenefits, DrawSubject, SIMULATION_COLUMNS
+
+# Row kinds of a lane in the next period, mirroring the branches of TreatySimulation.
+FREE, TREATY, BREAK, POSTBREAK = 0, 1, 2, 3
+REASONS = np.array([None, 'ContinueTreaty', 'BothBroken', 'SettlerBroken', 'NativeBroken', 'MatchEnding'], dtype=object)
+CONTINUE, BOTH, SETTLER, NATIVE, MATCH_ENDING = 1, 2, 3, 4, 5
+
+def TreatyLand(s_efficiency, u):
+    '''
+    Inverse-CDF version of Treaty.content_treaty's draw of the settler's treaty land.
+    '''
+    land_choices = np.arange(50, s_efficiency+1)
+    cdf = np.cumsum(land_choices/np.sum(land_choices))
+    return land_choices[np.minimum(np.searchsorted(cdf, u, side='right'), len(land_choices) - 1)]
+
+def BatchSpendingExpansion(n_land, current_period, spending_shock, n_savings, s_savings, spending_shock_size, rng, dp=dp):
+    '''
+    SpendingExpansion for an array of lands. The equilibrium is solved once per distinct land.
+    '''
+    lands, inverse = np.unique(n_land, return_inverse=True)
+    eq = np.empty((len(lands), 4))
+    for j, land in enumerate(lands):
+        spendings, _, eq_spending, _ = dp.PeriodEquilibrium(land, current_period)
+        eq[j] = eq_spending[0], eq_spending[1], spendings[0][-1], spendings[1][-1]
+    n_spending, s_spending, n_bound, s_bound = eq[inverse].T
+    if spending_shock:
+        mu, sd = spending_shock_size
+        n_shock, s_shock = mu + sd*rng.standard_normal((2, len(n_land)))
+        n_final, s_final = n_spending + n_shock, s_spending + s_shock
+        n_spending = np.where((n_final > n_bound) | (n_final < 0), n_spending, n_final)
+        s_spending = np.where((s_final > s_bound) | (s_final < 0), s_spending, s_final)
+    n_land_diff = dp.IfEqSpending(n_land, [n_spending, s_spending], simulation=True)
+    return n_spending, s_spending, n_savings - n_spending, s_savings - s_spending, n_land_diff
+
+def LockstepTreatySimulation(n_land_start, treaties, treatments,
+                             max_periods = 20,
+                             matches=100,
+                             endowments=100,
+                             spending_shock=True,
+                             spending_shock_size=(0, 2),
+                             sub_ids=None,
+                             rng=None,
+                             dp=dp):
+    '''
+    Run TreatySimulation for many subjects at once. Every (subject, match) pair is a lane of a set of state arrays,
+    and all lanes advance together one period at a time, so each period costs a handful of array operations
+    instead of a Python loop over rows. The rules are those of TreatySimulation, the random draws are batched
+    and come from rng, so single runs are not draw-for-draw identical to TreatySimulation.
+    Return a DataFrame with SubId followed by the TreatySimulation columns, ordered by subject, match and period.
+
+    Parameters:
+    ----------
+        n_land_start (float): Native's initial land of every match.
+        treaties (list[Treaty]): one Treaty per subject.
+        treatments (list[str]): 'annuity' or 'lumpsum' for each subject.
+        sub_ids (array-like[int]): subject ids, 101, 102, ... by default.
+        rng (numpy.random.Generator): source of all draws.
+        dp: DP instance used for the fighting periods.
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    n_subs = len(treaties)
+    sub_ids = np.arange(101, 101 + n_subs) if sub_ids is None else np.asarray(sub_ids)
+    lanes = n_subs * matches
+    coef = lambda name: np.repeat([getattr(tr, name) for tr in treaties], matches)
+    a, b, c, d, e = coef('a'), coef('b'), coef('c'), coef('d'), coef('e')
+    noise_sd, s_efficiency = coef('noise_sd'), coef('s_efficiency')
+    annuity = np.repeat(np.asarray(treatments) == 'annuity', matches)
+    payment = np.where(annuity, coef('annuity_payment'), coef('lumpsum_payment'))
+    accept = np.repeat([tr.accept_treaty() for tr in treaties], matches)
+    treatment = np.repeat(np.asarray(treatments, dtype=object), matches)
+
+    tot_periods = np.minimum(max_periods, rng.geometric(pd.prob, size=lanes))
+    mode = np.full(lanes, FREE)
+    n_land = np.full(lanes, float(n_land_start))
+    n_savings, s_savings = np.full(lanes, float(endowments)), np.full(lanes, float(endowments))
+    n_savings_end, s_savings_end = np.zeros(lanes), np.zeros(lanes)
+    n_income, s_income = np.zeros(lanes), np.zeros(lanes)
+    n_spending, s_spending = np.zeros(lanes), np.zeros(lanes)
+    s_treaty_land, transfer = np.zeros(lanes), np.zeros(lanes)
+    treaty_counter = np.zeros(lanes, dtype=int)
+    records = []
+
+    def Record(idx, period, n_sp, s_sp, n_land_end, treaty, counter, payment, reason):
+        records.append([idx, np.full(len(idx), period), n_sp, s_sp, n_savings[idx], n_savings_end[idx], s_savings[idx],
+                        s_savings_end[idx], n_land[idx], n_land_end, n_income[idx], s_income[idx], treaty, counter, payment, reason])
+
+    for period in range(1, max_periods + 1):
+        active = period <= tot_periods
+        if not np.any(active):
+            break
+        free = active & (mode == FREE)
+        in_treaty = active & (mode == TREATY)
+        broken = active & (mode == BREAK)
+        post_break = active & (mode == POSTBREAK)
+
+        # start of a regular period: pure income change, then maybe a treaty proposal
+        n_income[free] = ie.NativeIncome(n_land[free])
+        s_income[free] = ie.SettlerIncome(100 - n_land[free])
+        n_savings_end[free] = n_savings[free] + n_income[free]
+        s_savings_end[free] = s_savings[free] + s_income[free]
+        started = np.zeros(lanes, dtype=bool)
+        if period >= 2:
+            idx = np.nonzero(free)[0]
+            tr = Treaty(None, a[idx], b[idx], c[idx], d[idx], e[idx], noise_sd[idx])
+            prob_tr = tr.propose_treaty(100 - n_land[idx], s_spending[idx], noise=noise_sd[idx]*rng.standard_normal(len(idx)))
+            proposed = rng.random(len(idx)) < prob_tr
+            accepted = proposed & (rng.random(len(idx)) < accept[idx])
+            idx = idx[accepted]
+            benefits = TotalTreatyBenefits(n_land[idx], n_spending[idx], s_spending[idx])
+            u = rng.random(len(idx))
+            for s_eff in np.unique(s_efficiency[idx]):
+                same = s_efficiency[idx] == s_eff
+                s_treaty_land[idx[same]] = TreatyLand(s_eff, u[same])
+            transfer[idx] = np.minimum(payment[idx] * benefits, s_savings_end[idx])
+            n_savings_end[idx] += transfer[idx]
+            s_savings_end[idx] -= transfer[idx]
+            treaty_counter[idx] = 0
+            started[idx] = True
+            in_treaty |= started
+
+        # treaty periods
+        idx = np.nonzero(in_treaty)[0]
+        if len(idx):
+            treaty_counter[idx] += 1
+            reason = np.full(len(idx), MATCH_ENDING)
+            goes_on = period + 1 <= tot_periods[idx]
+            k = np.count_nonzero(goes_on)
+            draw_s_ending, draw_n_ending = rng.random((2, k))
+            j = idx[goes_on]
+            tr = Treaty(None, a[j], b[j], c[j], d[j], e[j], noise_sd[j])
+            s_ending, n_ending = tr.end_treaty(s_treaty_land[j], noise=noise_sd[j]*rng.standard_normal(k),
+                                               p_native_ending=rng.uniform(0, 0.4, size=k))
+            s_break, n_break = draw_s_ending <= s_ending, draw_n_ending <= n_ending
+            reason[goes_on] = np.select([~s_break & ~n_break, s_break & n_break, s_break], [CONTINUE, BOTH, SETTLER], NATIVE)
+            Record(idx, period, np.zeros(len(idx)), np.zeros(len(idx)), 100 - s_treaty_land[idx], treatment[idx],
+                   treaty_counter[idx].astype(float), transfer[idx], reason)
+            n_income[idx] = ie.NativeIncome(100 - s_treaty_land[idx])
+            s_income[idx] = ie.SettlerIncome(s_treaty_land[idx])
+            go = idx[reason == CONTINUE]
+            n_savings[go], s_savings[go] = n_savings_end[go], s_savings_end[go]
+            n_land[go] = 100 - s_treaty_land[go]
+            n_savings_end[go] = n_savings[go] + n_income[go] + np.where(annuity[go], transfer[go], 0)
+            s_savings_end[go] = s_savings[go] + s_income[go] - np.where(annuity[go], transfer[go], 0)
+            stop = idx[(reason != CONTINUE) & (reason != MATCH_ENDING)]
+            n_savings[stop], s_savings[stop] = n_savings_end[stop], s_savings_end[stop]
+            mode[idx] = TREATY
+            mode[stop] = BREAK
+
+        # first period after a broken treaty, no fighting
+        idx = np.nonzero(broken)[0]
+        if len(idx):
+            n_savings_end[idx] = n_savings[idx] + n_income[idx]
+            s_savings_end[idx] = s_savings[idx] + s_income[idx]
+            nans = np.full(len(idx), np.nan)
+            Record(idx, period, np.zeros(len(idx)), np.zeros(len(idx)), n_land[idx], nans, nans, nans,
+                   np.zeros(len(idx), dtype=int))
+            n_savings[idx], s_savings[idx] = n_savings_end[idx], s_savings_end[idx]
+            n_savings_end[idx] = n_savings[idx] + n_income[idx]
+            s_savings_end[idx] = s_savings[idx] + s_income[idx]
+            mode[idx] = POSTBREAK
+
+        # fighting periods
+        idx = np.nonzero((free & ~started) | post_break)[0]
+        if len(idx):
+            n_sp, s_sp, n_savings_end[idx], s_savings_end[idx], n_land_diff = BatchSpendingExpansion(
+                n_land[idx], period, spending_shock, n_savings_end[idx], s_savings_end[idx], spending_shock_size, rng, dp)
+            n_spending[idx], s_spending[idx] = n_sp, s_sp
+            nans = np.full(len(idx), np.nan)
+            Record(idx, period, n_sp, s_sp, n_land[idx] + n_land_diff, nans, nans, nans, np.zeros(len(idx), dtype=int))
+            n_land[idx] += n_land_diff
+            n_savings[idx], s_savings[idx] = n_savings_end[idx], s_savings_end[idx]
+            mode[idx] = FREE
+
+    lane, period, n_sp, s_sp, n_init, n_end, s_init, s_end, land_init, land_end, n_inc, s_inc, treaty, counter, paid, reason = \
+        [np.concatenate(column) for column in zip(*records)]
+    order = np.lexsort((period, lane))
+    columns = [lane%matches + 1, period, n_sp, s_sp, n_init, n_end, s_init, s_end, land_init, land_end,
+               100 - land_init, 100 - land_end, n_inc, s_inc, treaty, counter, paid, REASONS[reason]]
+    simulated_data = pandas.DataFrame({name: column[order] for name, column in zip(SIMULATION_COLUMNS, columns)})
+    simulated_data.insert(0, 'SubId', sub_ids[lane[order]//matches])
+    return simulated_data.astype({'Treatment': object, 'TreatyEndingReason': object})
+
+def LockstepSubjects(n_subs, n_land_start=65, matches=4, rng=None, **kwargs):
+    '''
+    Lockstep counterpart of the Treaty_simulation driver: draw n_subs subjects with DrawSubject
+    and simulate all their matches together. kwargs are passed to LockstepTreatySimulation.
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    treaties, treatments = zip(*[DrawSubject(rng) for _ in range(n_subs)])
+    return LockstepTreatySimulation(n_land_start, list(treaties), list(treatments), matches=matches, rng=rng, **kwargs)
@@ -0,0 +1,88 @@
+### Annuity versus lumpsum comparisons with common random numbers and antithetic draws ###
+
+from functools import partial
+import numpy as np
+import pandas
+from Treaty_game_model import RandomStream
+import Treaty_simulation as simulation
+
+TREATMENTS = ['annuity', 'lumpsum']
+
+def MeanFinal(data, column):
+    return data.groupby('Match')[column].last().mean()
+
+def MeanTreatyLength(data):
+    ends = data[data.TreatyEndingReason.notna() & (data.TreatyEndingReason != 'ContinueTreaty')]
+    return ends.TreatyPeriod.mean() if len(ends) else np.nan
+
+def MeanTransfer(data):
+    '''
+    Transfers received by the Native per match: the annuity on every treaty row, the lumpsum on the first.
+    '''
+    rows = data[data.TreatyPeriod.notna()]
+    paid = rows[(rows.Treatment == 'annuity') | (rows.TreatyPeriod == 1)]
+    return paid.TreatyPayment.sum()/data.Match.nunique()
+
+# subject-level outcomes whose annuity - lumpsum differences are estimated
+OUTCOMES = {'FinalNativeSaving': partial(MeanFinal, column='EndNativeSaving'),
+            'FinalSettlerSaving': partial(MeanFinal, column='EndSettlerSaving'),
+            'TreatyLength': MeanTreatyLength,
+            'Transfer': MeanTransfer}
+
+def PairedSubject(seed, n_land_start=65, matches=4, antithetic=True, outcomes=OUTCOMES, **kwargs):
+    '''
+    Draw one subject from seed and simulate it under both treatments with common random numbers: both arms
+    read the same RandomStream, so proposals, endings, treaty lands and spending shocks coincide and only the
+    treatment differs. If antithetic, both arms are run again on the mirrored stream. Return an array of the
+    outcomes, shape (2 if antithetic else 1, treatments, outcomes). kwargs are passed to TreatySimulation.
+    '''
+    subject_seed, stream_seed = seed.spawn(2)
+    subject, _ = simulation.DrawSubject(np.random.default_rng(subject_seed))
+    values = []
+    for mirrored in ([False, True] if antithetic else [False]):
+        arms = []
+        for treatment in TREATMENTS:
+            tr = simulation.Treaty(subject.s_efficiency, subject.a, subject.b, subject.c, subject.d, subject.e, subject.noise_sd,
+                                   subject.annuity_payment, subject.lumpsum_payment,
+                                   stream=RandomStream(stream_seed, antithetic=mirrored))
+            data = simulation.TreatySimulation(n_land_start, tr, treatment, matches=matches, **kwargs)
+            arms.append([fun(data) for fun in outcomes.values()])
+        values.append(arms)
+    return np.array(values, dtype=float)
+
+def CompareTreatments(n_subs=50, seed=None, antithetic=True, outcomes=OUTCOMES, mapper=map, **kwargs):
+    '''
+    Estimate the annuity - lumpsum effect on every outcome from n_subs subjects run by PairedSubject, and the
+    variance reduction against the driver's design (one independent subject per run, treatment at random),
+    at equal number of runs. The independent-design variance is estimated from the same runs, as the sum of
+    the arms' variances. Return a DataFrame with, per outcome, the effect, its standard error, the variance
+    per pair of runs of each design and the reduction factors (independent variance over the design's).
+
+    Parameters:
+    ----------
+        n_subs (int): number of subjects; each costs 2 runs, or 4 if antithetic.
+        seed: subject i is drawn from the i-th child of SeedSequence(seed).
+        antithetic (bool): add the mirrored pair of runs.
+        outcomes (dict): name -> function of a subject's TreatySimulation data, returning a number.
+        mapper (callable): map-like function over subjects, e.g. a ProcessPoolExecutor's map.
+        kwargs: passed to TreatySimulation (n_land_start, matches are PairedSubject's).
+    '''
+    subject = partial(PairedSubject, antithetic=antithetic, outcomes=outcomes, **kwargs)
+    values = np.array(list(mapper(subject, np.random.SeedSequence(seed).spawn(n_subs)))) # (subjects, mirrors, arms, outcomes)
+    diffs = values[:, :, 0] - values[:, :, 1]
+    rows = {}
+    with np.errstate(divide='ignore', invalid='ignore'): # a difference can be exactly 0 under CRN
+        for j, name in enumerate(outcomes):
+            runs, diff = values[:, :, :, j], diffs[:, :, j]
+            keep = ~np.isnan(diff).any(axis=1) # subjects with the outcome defined in every run
+            runs, diff = runs[keep], diff[keep]
+            independent = np.var(runs[:, :, 0], ddof=1) + np.var(runs[:, :, 1], ddof=1)
+            crn = np.var(diff, ddof=1)
+            subject_effect = diff.mean(axis=1)
+            row = {'Effect': subject_effect.mean(), 'StdErr': np.std(subject_effect, ddof=1)/np.sqrt(len(diff)),
+                   'Subjects': len(diff), 'VarIndependent': independent, 'VarCRN': crn, 'ReductionCRN': independent/crn}
+            if antithetic:
+                row['VarAntithetic'] = 2*np.var(subject_effect, ddof=1) # mirrored pairs cost two pairs of runs
+                row['ReductionAntithetic'] = independent/row['VarAntithetic']
+            rows[name] = row
+    return pandas.DataFrame.from_dict(rows, orient='index')
@@ -0,0 +1,18 @@
+'''
+Treaty game models and simulations. The modules are scripts that import each other by name, so importing the
+package only puts this directory on sys.path; no module is loaded until it is used, e.g.
+simulations.Treaty_simulation, which is the same module object as `import Treaty_simulation`.
+Command line: python -m simulations {simulate,profits,calibrate} --help
+'''
+import os
+import sys
+import importlib
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+if DIRECTORY not in sys.path:
+    sys.path.insert(0, DIRECTORY)
+
+def __getattr__(name):
+    if name.startswith('Treaty_'):
+        return importlib.import_module(name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
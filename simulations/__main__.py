@@ -0,0 +1,117 @@
+### Command line entry point: python -m simulations {simulate,profits,calibrate} ###
+
+import sys
+import json
+import argparse
+
+DEFAULT_IE = [120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5]
+DEFAULT_BOUNDS = [0, 100, 10, 100, 100, 150, 0.1, 0.5]
+
+def Map(fun, tasks, workers):
+    '''
+    map over tasks in this process, or across a process pool if workers > 1.
+    '''
+    if workers == 1:
+        return list(map(fun, tasks))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fun, tasks, chunksize=max(1, len(tasks)//(4*workers))))
+
+def Simulate(args):
+    '''
+    The Treaty_simulation driver: n_subs subjects, subject i drawn from the i-th child of SeedSequence(seed).
+    '''
+    from functools import partial
+    import numpy as np
+    import pandas
+    from Treaty_sequential import TreatySubject
+    subject = partial(TreatySubject, n_land_start=args.n_land, matches=args.matches, max_periods=args.max_periods,
+                      spending_shock=not args.no_shock)
+    data = Map(subject, np.random.SeedSequence(args.seed).spawn(args.n_subs), args.workers)
+    for i, subject_data in enumerate(data, 1):
+        subject_data.insert(0, 'SubId', 100+i)
+    float_format = None if args.precision is None else '%.{}f'.format(args.precision)
+    pandas.concat(data).to_csv(args.output, index=False, float_format=float_format)
+    print('{} rows of {} subjects written to {}'.format(sum(len(d) for d in data), args.n_subs, args.output))
+
+def Profits(args):
+    '''
+    The profits study: n runs of DP.Simulation with geometric uncertainty periods.
+    '''
+    import Treaty_game_model as model
+    from Treaty_game_runner import RunSimulations
+    ie = model.IncomeExpansion(*args.ie)
+    decision = model.NaivePlayerDecision if args.decision == 'naive' else model.PlayerDecision
+    dp = model.DP(ie, decision(ie, args.prob, args.n_default), ne_method=args.ne_method, cache=model.EquilibriumCache())
+    res = RunSimulations(dp, args.n_land, n=args.n, seed=args.seed, workers=args.workers, saving=not args.no_saving,
+                         shock=not args.no_shock, incremental=args.incremental)
+    res.to_csv(args.output, index=False)
+    print(res.describe().loc[['mean', 'std']].to_string())
+
+def Calibrate(args):
+    '''
+    Multi-start calibration of (D, E, H, alpha) to the target land.
+    '''
+    import numpy as np
+    from Treaty_game_equations_solver import calibrate
+    bounds = np.array(args.bounds, dtype=float).reshape(4, 2)
+    res = calibrate(bounds, args.x0, args.n_starts, args.target_land, args.seed, args.workers)
+    summary = {'params': dict(zip(['D', 'E', 'H', 'alpha'], res.x.tolist())), 'objective': float(res.fun),
+               'equilibrium': dict(zip(['land', 'n_spending', 's_spending'], res.eq.tolist())),
+               'inner_solves': res.inner_solves, 'time': res.time}
+    print(json.dumps(summary, indent=1))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=1)
+
+def Parser():
+    parser = argparse.ArgumentParser(prog='python -m simulations', description='Treaty game simulations and calibration.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--seed', type=int, help='seed of the SeedSequence every run is drawn from')
+    common.add_argument('--workers', type=int, default=1, help='worker processes')
+
+    simulate = commands.add_parser('simulate', parents=[common], help='simulate treaty subjects (Treaty_simulation)')
+    simulate.add_argument('--n-subs', type=int, default=50)
+    simulate.add_argument('--matches', type=int, default=4)
+    simulate.add_argument('--n-land', type=float, default=65)
+    simulate.add_argument('--max-periods', type=int, default=20)
+    simulate.add_argument('--no-shock', action='store_true', help='no spending shocks')
+    simulate.add_argument('--precision', type=int, help='decimals of the written floats, all of them by default')
+    simulate.add_argument('--output', default='SimulatedData.csv')
+    simulate.set_defaults(run=Simulate)
+
+    profits = commands.add_parser('profits', parents=[common], help='profits of DP.Simulation runs')
+    profits.add_argument('--n', type=int, default=200, help='number of runs')
+    profits.add_argument('--n-land', type=float, default=65)
+    profits.add_argument('--ie', type=float, nargs=11, default=DEFAULT_IE, metavar='P',
+                         help='IncomeExpansion params A1 B1 C1 A2 B2 C2 D E H gamma beta')
+    profits.add_argument('--prob', type=float, default=1/6)
+    profits.add_argument('--n-default', type=int, default=10)
+    profits.add_argument('--decision', choices=['naive', 'full'], default='naive')
+    profits.add_argument('--no-saving', action='store_true')
+    profits.add_argument('--no-shock', action='store_true')
+    profits.add_argument('--ne-method', choices=['grid', 'exact', 'direct'], default='grid', help='DP equilibrium method')
+    profits.add_argument('--incremental', action='store_true', help='track equilibria period to period (--ne-method direct)')
+    profits.add_argument('--output', default='profit_simulation_data.csv')
+    profits.set_defaults(run=Profits)
+
+    calibration = commands.add_parser('calibrate', parents=[common], help='calibrate D, E, H, alpha to a target land')
+    calibration.add_argument('--bounds', type=float, nargs=8, default=DEFAULT_BOUNDS, metavar='B',
+                             help='low and high of D, E, H and alpha')
+    calibration.add_argument('--x0', type=float, nargs=4, help='extra start point')
+    calibration.add_argument('--n-starts', type=int, default=8)
+    calibration.add_argument('--target-land', type=float, default=60)
+    calibration.add_argument('--output', help='write the result to this JSON file')
+    calibration.set_defaults(run=Calibrate)
+    return parser
+
+def Main(argv=None):
+    args = Parser().parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    if __package__ in (None, ''): # run as a script, not with -m
+        import os
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    Main()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+from Treaty_game_backward import BackwardInduction, BackwardDP
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+
+@pytest.fixture(scope='module')
+def policy():
+    return BackwardInduction(model.IncomeExpansion(*IE_PARAMS), 1/6, 10, lands=np.linspace(1, 99, 50), actions=21)
+
+def test_policy_records_its_game(policy):
+    assert policy.ie_params == IE_PARAMS
+    assert (policy.prob, policy.n_default) == (1/6, 10)
+
+@pytest.mark.parametrize('ie_params, prob, n_default, message', [
+    (IE_PARAMS[:-1] + (0.4,), 1/6, 10, 'IncomeExpansion params'),
+    (IE_PARAMS, 1/5, 10, 'end probability'),
+    (IE_PARAMS, 1/6, 8, 'default periods'),
+])
+def test_backward_dp_rejects_another_game(policy, ie_params, prob, n_default, message):
+    ie = model.IncomeExpansion(*ie_params)
+    with pytest.raises(ValueError, match=message):
+        BackwardDP(ie, model.NaivePlayerDecision(ie, prob, n_default), policy)
+
+def test_backward_dp_accepts_its_game(policy):
+    ie = model.IncomeExpansion(*IE_PARAMS)
+    dp = BackwardDP(ie, model.NaivePlayerDecision(ie, 1/6, 10), policy)
+    np.testing.assert_allclose(dp.PeriodEquilibrium(50, 3)[2], policy.Lookup(50, 3))
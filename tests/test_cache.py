@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+
+@pytest.fixture
+def dps():
+    ie = model.IncomeExpansion(*IE_PARAMS)
+    pd = model.NaivePlayerDecision(ie, 1/6, 10, method='golden')
+    return model.DP(ie, pd), model.DP(ie, pd, cache=model.EquilibriumCache(maxsize=2))
+
+def test_hits_misses_evictions(dps):
+    dp, cached = dps
+    for n_land in [65, 60, 65, 55]: # 55 evicts 60, as 65 was used more recently
+        cached.PeriodEquilibrium(n_land, 1)
+    stats = cached.cache.Stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (1, 3, 1, 2)
+    np.testing.assert_equal(cached.PeriodEquilibrium(65, 1)[2], dp.PeriodEquilibrium(65, 1)[2])
+    cached.PeriodEquilibrium(60, 1)
+    stats = cached.cache.Stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 4, 2)
+
+def test_key_separates_models(dps):
+    _, cached = dps
+    ie = cached.ie
+    other = model.DP(ie, model.NaivePlayerDecision(ie, 1/6, 10, method='newton'), cache=cached.cache)
+    cached.PeriodEquilibrium(65, 1)
+    other.PeriodEquilibrium(65, 1)
+    assert cached.cache.Stats()['misses'] == 2
+
+def test_hits_are_copies(dps):
+    dp, cached = dps
+    first = cached.PeriodEquilibrium(65, 1)
+    expected = dp.PeriodEquilibrium(65, 1)
+    first[0][0][:] = -1
+    first[2][0] = -1
+    hit = cached.PeriodEquilibrium(65, 1)
+    np.testing.assert_equal(hit[0], expected[0])
+    np.testing.assert_equal(hit[2], expected[2])
+    hit[2][1] = -1
+    np.testing.assert_equal(cached.PeriodEquilibrium(65, 1)[2], expected[2])
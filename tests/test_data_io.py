@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pandas
+import pytest
+import Treaty_simulation as simulation
+from Treaty_game_model import NaivePlayerDecision, DP, EquilibriumCache
+from Treaty_data_io import SimulationStream, ColumnarWriter, ColumnarReader, WriteStream, COLUMNS
+
+@pytest.fixture
+def stream(monkeypatch):
+    dp = DP(simulation.ie, NaivePlayerDecision(simulation.ie, 1/6, 10, method='golden'), cache=EquilibriumCache())
+    monkeypatch.setattr(simulation, 'dp', dp)
+    return list(SimulationStream(3, matches=3, rng=np.random.default_rng(0)))
+
+def Expected(stream, treatment=None):
+    '''
+    The rows as ToPandas returns them: numbers as floats, missing text as None.
+    '''
+    rows = [row for partition, rows in stream for row in rows if treatment in (None, partition['Treatment'])]
+    data = pandas.DataFrame(rows, columns=COLUMNS)
+    for column in COLUMNS:
+        if column in ('Treatment', 'TreatyEndingReason'):
+            data[column] = [None if value is None or value != value else value for value in data[column]]
+        else:
+            data[column] = data[column].astype(float)
+    return data
+
+def Sorted(data):
+    return data.sort_values(['SubId', 'Match', 'CurrentPeriod'], ignore_index=True)
+
+def test_round_trip(stream, tmp_path):
+    pieces = [(partition, rows[i:i+7]) for partition, rows in stream for i in range(0, len(rows), 7)]
+    n_rows = WriteStream(iter(pieces), str(tmp_path), chunk_rows=7)
+    reader = ColumnarReader(str(tmp_path))
+    data = Sorted(reader.ToPandas())
+    assert len(data) == n_rows == sum(len(rows) for _, rows in stream)
+    assert len(reader.PartPaths()) == len(pieces)
+    pandas.testing.assert_frame_equal(data, Expected(stream), check_dtype=False)
+    treatment = stream[0][0]['Treatment']
+    pandas.testing.assert_frame_equal(Sorted(reader.ToPandas(Treatment=treatment)), Expected(stream, treatment),
+                                      check_dtype=False)
+
+def test_interrupted_part_is_not_counted(stream, tmp_path):
+    partition, rows = stream[0]
+    with ColumnarWriter(str(tmp_path), chunk_rows=len(rows)) as writer:
+        writer.Append(partition, rows)
+    path = os.path.join(str(tmp_path), 'Treatment=' + partition['Treatment'], 'SubId={}'.format(partition['SubId']))
+    os.makedirs(os.path.join(path, 'part-00001.tmp')) # left by a write that was killed
+    with ColumnarWriter(str(tmp_path), chunk_rows=len(rows)) as writer:
+        writer.Append(partition, rows)
+    assert sorted(os.listdir(path)) == ['part-00000', 'part-00001']
+    assert len(ColumnarReader(str(tmp_path)).ToPandas()) == 2 * len(rows)
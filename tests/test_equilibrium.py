@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+STATES = [(land, current_p) for land in [30, 50, 65, 80] for current_p in [1, 12]]
+
+@pytest.fixture(scope='module', params=[model.PlayerDecision, model.NaivePlayerDecision])
+def dp(request):
+    ie = model.IncomeExpansion(*IE_PARAMS)
+    return model.DP(ie, request.param(ie, 1/6, 10, method='golden'))
+
+@pytest.mark.parametrize('n_land, current_p', STATES)
+def test_exact_ne_matches_grid_ne(dp, n_land, current_p):
+    spendings, responses = dp.ResponseList(n_land, current_p)
+    steps = [spendings[0][1] - spendings[0][0], spendings[1][1] - spendings[1][0]]
+    grid = dp.FindNE(spendings, responses)
+    assert grid is not None
+
+    exact, residual, converged = dp.FindExactNE(spendings, responses, xtol=1e-10)
+    assert converged
+    assert residual < 1e-10
+    assert np.all(np.abs(np.subtract(exact, grid)) <= steps)
+
+    _, direct, residual, converged = dp.SolveNE(n_land, current_p, xtol=1e-8)
+    assert converged
+    assert residual < 1e-8
+    assert np.all(np.abs(np.subtract(direct, grid)) <= steps)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas
+import pytest
+import Treaty_simulation as simulation
+from Treaty_game_model import NaivePlayerDecision, DP, EquilibriumCache, RandomStream
+from Treaty_simulation_lockstep import LockstepTreatySimulation
+
+NUMERIC = ['NativeSpending', 'SettlerSpending', 'InitNativeSaving', 'EndNativeSaving', 'InitSettlerSaving', 'EndSettlerSaving',
+           'InitNativeLand', 'EndNativeLand', 'NativeIncome', 'SettlerIncome']
+
+@pytest.fixture
+def dp(monkeypatch):
+    '''
+    Both engines on one DP with golden-section responses, which keeps the many treaty-land restarts fast.
+    '''
+    dp = DP(simulation.ie, NaivePlayerDecision(simulation.ie, 1/6, 10, method='golden'), cache=EquilibriumCache())
+    monkeypatch.setattr(simulation, 'dp', dp)
+    return dp
+
+def Subject(c):
+    return simulation.Treaty(simulation.ie.global_efficiency, 0.05, 0.03, c, 0.04, 2, 2)
+
+def Run(dp, tr, treatment, matches, seed):
+    one = simulation.TreatySimulation(65, simulation.Treaty(tr.s_efficiency, tr.a, tr.b, tr.c, tr.d, tr.e, tr.noise_sd,
+                                                            stream=RandomStream(seed)),
+                                      treatment, matches=matches, spending_shock=False)
+    lockstep = LockstepTreatySimulation(65, [tr], [treatment], matches=matches, spending_shock=False,
+                                        rng=np.random.default_rng(seed), dp=dp)
+    return one, lockstep.drop(columns='SubId')
+
+def test_fighting_rows_match_exactly(dp):
+    '''
+    Without treaties or shocks both engines play the same deterministic path, so rows of a period coincide.
+    '''
+    one, lockstep = Run(dp, Subject(c=50), 'annuity', matches=30, seed=1)
+    assert one.TreatyPeriod.isna().all() and lockstep.TreatyPeriod.isna().all()
+    one, lockstep = [data.drop_duplicates('CurrentPeriod').set_index('CurrentPeriod')[NUMERIC] for data in (one, lockstep)]
+    periods = one.index.intersection(lockstep.index)
+    assert len(periods) >= 10
+    pandas.testing.assert_frame_equal(one.loc[periods], lockstep.loc[periods], check_dtype=False, rtol=1e-12)
+
+def PerMatch(data):
+    matches = data.groupby('Match')
+    return pandas.DataFrame({'Periods': matches.size(), 'TreatyRows': matches.TreatyPeriod.count(),
+                             'FinalNativeSaving': matches.EndNativeSaving.last(),
+                             'FinalSettlerSaving': matches.EndSettlerSaving.last(),
+                             'FinalNativeLand': matches.EndNativeLand.last()})
+
+def test_treaty_distributions_agree(dp):
+    '''
+    With treaties the engines draw differently, so per-match outcomes are compared within sampling error.
+    '''
+    for treatment, seed in [('annuity', 2), ('lumpsum', 3)]:
+        one, lockstep = Run(dp, Subject(c=0), treatment, matches=300, seed=seed)
+        one_matches, lockstep_matches = PerMatch(one), PerMatch(lockstep)
+        diff = one_matches.mean() - lockstep_matches.mean()
+        se = np.sqrt(one_matches.var()/len(one_matches) + lockstep_matches.var()/len(lockstep_matches))
+        assert np.all(np.abs(diff) <= 4 * se), pandas.DataFrame({'diff': diff, 'se': se})
+        shares = [data.TreatyEndingReason.value_counts(normalize=True) for data in (one, lockstep)]
+        assert set(shares[0].index) == set(shares[1].index)
+        assert np.all(np.abs(shares[0] - shares[1][shares[0].index]) < 0.06), shares
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+from Treaty_game_policy import BuildPolicySurface, PolicySurface, SurfaceDP
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+LANDS = np.linspace(50, 70, 5)
+
+class NoGridNE(model.DP):
+    def FindNE(self, income_list, spending_list):
+        return None
+
+@pytest.fixture(scope='module')
+def ie_pd():
+    ie = model.IncomeExpansion(*IE_PARAMS)
+    return ie, model.NaivePlayerDecision(ie, 1/6, 10, method='golden')
+
+def test_surface_matches_solved_nodes(ie_pd, tmp_path):
+    ie, pd = ie_pd
+    dp = model.DP(ie, pd, 'exact')
+    surface = PolicySurface(BuildPolicySurface(dp, str(tmp_path), LANDS, periods=[1, 11]), dp)
+    surface_dp = SurfaceDP(ie, pd, surface, ne_method='exact')
+    for n_land in LANDS:
+        np.testing.assert_allclose(surface_dp.PeriodEquilibrium(n_land, 11)[2], dp.PeriodEquilibrium(n_land, 11)[2])
+
+def test_nodes_without_equilibrium_raise(ie_pd, tmp_path):
+    ie, pd = ie_pd
+    with pytest.raises(ValueError, match='No equilibrium at 10 of 10 nodes'):
+        BuildPolicySurface(NoGridNE(ie, pd), str(tmp_path), LANDS, periods=[1, 11])
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+LANDS = [10, 35, 50, 65, 90]
+SAVINGS = [None, 0, 40]
+
+@pytest.fixture(scope='module')
+def ie():
+    return model.IncomeExpansion(*IE_PARAMS)
+
+@pytest.mark.parametrize('decision', [model.PlayerDecision, model.NaivePlayerDecision])
+@pytest.mark.parametrize('method', ['golden', 'newton'])
+@pytest.mark.parametrize('current_p', [1, 15])
+def test_vectorized_responses_match_fminbound(ie, decision, method, current_p):
+    reference, fast = decision(ie, 1/6, 10), decision(ie, 1/6, 10, method=method)
+    for land in LANDS:
+        for savings in SAVINGS:
+            s_spendings = np.linspace(0, ie.SettlerIncome(100 - land), 9)
+            n_spendings = np.linspace(0, ie.NativeIncome(land), 9)
+            np.testing.assert_allclose(fast.NativeResponses(land, s_spendings, current_p, savings),
+                                       reference.NativeResponses(land, s_spendings, current_p, savings), atol=1e-4)
+            np.testing.assert_allclose(fast.SettlerResponses(100 - land, n_spendings, current_p, savings),
+                                       reference.SettlerResponses(100 - land, n_spendings, current_p, savings), atol=1e-4)
+
+def test_unknown_method(ie):
+    with pytest.raises(ValueError):
+        model.PlayerDecision(ie, 1/6, 10, method='bisect')
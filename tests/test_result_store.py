@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+import Treaty_simulation as simulation
+from Treaty_game_model import NaivePlayerDecision, DP, EquilibriumCache, Tracer
+from Treaty_result_store import ResultStore, StoredTreatySimulation, StoredSimulations
+
+@pytest.fixture
+def dp(monkeypatch):
+    dp = DP(simulation.ie, NaivePlayerDecision(simulation.ie, 1/6, 10, method='golden'), cache=EquilibriumCache())
+    monkeypatch.setattr(simulation, 'dp', dp)
+    return dp
+
+def Subject():
+    return simulation.Treaty(simulation.ie.global_efficiency, 0.05, 0.03, 50, 0.04, 2, 2)
+
+def test_tracer_does_not_change_the_key(dp, tmp_path):
+    store = ResultStore(str(tmp_path), version='test')
+    tracers = [Tracer(), Tracer()] # both alive, so their str() differ
+    first = StoredTreatySimulation(store, 65, Subject(), 'annuity', seed=1, matches=2, tracer=tracers[0],
+                                   spending_shock_size=np.array([0, 2]))
+    tracer = tracers[1]
+    second = StoredTreatySimulation(store, 65, Subject(), 'annuity', seed=1, matches=2, tracer=tracer,
+                                    spending_shock_size=(0, 2))
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert not tracer.counters # loaded, not run again
+    assert first.equals(second)
+
+def test_options_must_be_json(dp, tmp_path):
+    store = ResultStore(str(tmp_path), version='test')
+    with pytest.raises(TypeError, match='not a JSON value'):
+        StoredSimulations(store, dp, 65, seed=1, n=2, shock_size=object())
+    assert not os.listdir(str(tmp_path))
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from Treaty_game_equations_solver import IncomeExpansion
+
+PARAMS = [120, 0.045, 18, 180, 0.065, 40, 5, 20, 120, 0.4, 0.4, 1/6]
+POINTS = [(40, 20, 40), (60, 5, 30), (25, 60, 10)]
+
+def CentralDifference(fun, x, h):
+    x = np.asarray(x, dtype=float)
+    columns = []
+    for i in range(len(x)):
+        step = np.zeros(len(x))
+        step[i] = h * max(1, abs(x[i]))
+        columns.append((fun(x + step) - fun(x - step))/(2*step[i]))
+    return np.stack(columns, axis=1)
+
+@pytest.mark.parametrize('point', POINTS)
+def test_com_jac_matches_central_differences(point):
+    ie = IncomeExpansion(*PARAMS)
+    np.testing.assert_allclose(ie.ComJac(np.array(point, dtype=float)), CentralDifference(ie.ComFuns, point, 1e-6),
+                               rtol=1e-5, atol=1e-8)
+
+def test_com_jac_batched():
+    ie = IncomeExpansion(*PARAMS)
+    points = np.array(POINTS, dtype=float).T
+    batched = ie.ComJac(points)
+    assert batched.shape == (3, 3, len(POINTS))
+    for i in range(len(POINTS)):
+        np.testing.assert_allclose(batched[..., i], ie.ComJac(points[:, i]))
+
+@pytest.mark.parametrize('point', POINTS)
+def test_com_param_jac_matches_central_differences(point):
+    x = np.array(point, dtype=float)
+    funs = lambda params: IncomeExpansion(*params).ComFuns(x)
+    np.testing.assert_allclose(IncomeExpansion(*PARAMS).ComParamJac(x), CentralDifference(funs, PARAMS, 1e-6),
+                               rtol=1e-5, atol=1e-8)
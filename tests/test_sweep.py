@@ -0,0 +1,34 @@
+import numpy as np
+from Treaty_game_sweep import ModelBatch, SolveBatch, Sensitivities, SensitivityTable, SENSITIVITY_NAMES, BASE_PARAMS
+from Treaty_game_equations_solver import X_START
+
+POINTS = {'D': [5, 10], 'E': [20, 20], 'H': [120, 125], 'gamma': [0.4, 0.45], 'beta': [0.4, 0.45]}
+
+def Solve(params):
+    x, _, converged = SolveBatch(ModelBatch(params), np.repeat(X_START[:, None], 2, axis=1).astype(float))
+    assert converged.all()
+    return x
+
+def Nudged(name, step):
+    '''
+    POINTS with name moved by step; alpha moves gamma and beta together.
+    '''
+    params = {key: np.array(value, dtype=float) for key, value in POINTS.items()}
+    for key in (['gamma', 'beta'] if name == 'alpha' else [name]):
+        params[key] = np.asarray(params.get(key, BASE_PARAMS[key]), dtype=float) + step
+    return params
+
+def test_sensitivities_match_resolved_equilibria():
+    x = Solve(POINTS)
+    sens = Sensitivities(POINTS, x)
+    assert sens.shape == (3, len(SENSITIVITY_NAMES), 2)
+    for j, name in enumerate(SENSITIVITY_NAMES):
+        h = 1e-5 * max(1, abs(BASE_PARAMS.get(name, 1)))
+        difference = (Solve(Nudged(name, h)) - Solve(Nudged(name, -h)))/(2*h)
+        np.testing.assert_allclose(sens[:, j], difference, rtol=1e-4, atol=1e-6, err_msg=name)
+
+def test_elasticities():
+    x = Solve(POINTS)
+    table = SensitivityTable(POINTS, x, elasticity=True)
+    h = SENSITIVITY_NAMES.index('H')
+    np.testing.assert_allclose(table.loc[(1, 'Land'), 'H'], Sensitivities(POINTS, x)[0, h, 1] * 125/x[0, 1])
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import Treaty_game_model as model
+from Treaty_game_backward import BackwardInduction, BackwardDP
+
+IE_PARAMS = (120, 0.045, 18, 180, 0.065, 40, 0, 100, 150, 0.5, 0.5)
+
+@pytest.fixture(scope='module')
+def ie_pd():
+    ie = model.IncomeExpansion(*IE_PARAMS)
+    return ie, model.NaivePlayerDecision(ie, 1/6, 10, method='golden')
+
+def Paths(dp, incremental):
+    spending, land, _ = dp.DynamicNE(65, max_iter=15, verbose=False, incremental=incremental, record='summary')
+    return np.asarray(spending), np.asarray(land)
+
+def AssertSamePaths(dp, atol):
+    full, incremental = Paths(dp, False), Paths(dp, True)
+    for a, b in zip(full, incremental):
+        np.testing.assert_allclose(b, a, rtol=0, atol=atol)
+
+@pytest.mark.parametrize('ne_method', ['grid', 'exact', 'direct'])
+def test_incremental_matches_full(ie_pd, ne_method):
+    dp = model.DP(*ie_pd, ne_method=ne_method, grids=60, tracer=model.Tracer())
+    AssertSamePaths(dp, 1e-6)
+    counters = dp.tracer.counters
+    assert counters.get('tracked_periods', 0) > 0 if ne_method == 'direct' else 'tracked_periods' not in counters
+
+def test_incremental_backward_dp_reads_the_policy(ie_pd):
+    ie, pd = ie_pd
+    policy = BackwardInduction(ie, pd.prob, pd.n_dft, lands=np.linspace(1, 99, 50), actions=21)
+    dp = BackwardDP(ie, pd, policy, ne_method='direct', tracer=model.Tracer())
+    AssertSamePaths(dp, 0)
+    assert 'tracked_periods' not in dp.tracer.counters
+
+def test_tracked_periods_use_the_cache(ie_pd):
+    dp = model.DP(*ie_pd, ne_method='direct', cache=model.EquilibriumCache(), tracer=model.Tracer())
+    full = Paths(dp, False)
+    assert 'cache_hits' not in dp.tracer.counters
+    incremental = Paths(dp, True)
+    assert dp.tracer.counters['cache_hits'] == len(full[1])
+    for a, b in zip(full, incremental):
+        np.testing.assert_array_equal(b, a)